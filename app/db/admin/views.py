@@ -1,5 +1,7 @@
+import hashlib
 from fastapi import UploadFile
 from app.db.tables import Task, Prompt, TaskItem, TaskImage
+from app.repositories.prompt import PromptRepository
 from sqladmin import ModelView
 from wtforms import FileField
 
@@ -31,5 +33,14 @@ class PromptView(ModelView, model=Prompt):
         data['image'] = await data['image'].read()
         if not data['image']:
             data['image'] = None
+        data['image_hash'] = hashlib.sha256(data['image']).hexdigest() if data['image'] else None
         return data
 
+    async def after_model_change(self, data: dict, model, is_created, request):
+        async with PromptRepository() as repository:
+            await repository.notify_changed(model.id)
+
+    async def after_model_delete(self, model, request):
+        async with PromptRepository() as repository:
+            await repository.notify_changed(model.id)
+
@@ -0,0 +1,6 @@
+from sqlalchemy_service.base_db.base import engine
+
+
+def asyncpg_dsn() -> str:
+    """DSN of the application database for raw asyncpg connections"""
+    return engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
@@ -0,0 +1,56 @@
+"""add task indexes
+
+Revision ID: 922f8f1fd0cf
+Revises: 86c5d6d55ab8
+Create Date: 2026-10-18 12:31:45.208117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '922f8f1fd0cf'
+down_revision = '86c5d6d55ab8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Built concurrently, so big tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_task_items_task_id'), 'task_items', ['task_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(
+            'ix_task_items_queued', 'task_items', ['task_id'], unique=False,
+            postgresql_include=['next_poll_at'],
+            postgresql_where=sa.text("status = 'queued'"),
+            postgresql_concurrently=True
+        )
+        op.create_index(op.f('ix_task_images_task_id'), 'task_images', ['task_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_tasks_created_at', 'tasks', ['created_at'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_tasks_user_id_created_at', 'tasks', ['user_id', 'created_at'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_tasks_app_bundle_created_at', 'tasks', ['app_bundle', 'created_at'], unique=False, postgresql_concurrently=True)
+        # Admin search is a substring ILIKE, only trigram indexes can serve it
+        op.create_index(
+            'ix_tasks_user_id_trgm', 'tasks', ['user_id'], unique=False,
+            postgresql_using='gin', postgresql_ops={'user_id': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_tasks_app_bundle_trgm', 'tasks', ['app_bundle'], unique=False,
+            postgresql_using='gin', postgresql_ops={'app_bundle': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tasks_app_bundle_trgm', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_user_id_trgm', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_app_bundle_created_at', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_user_id_created_at', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index('ix_tasks_created_at', table_name='tasks', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_task_images_task_id'), table_name='task_images', postgresql_concurrently=True)
+        op.drop_index('ix_task_items_queued', table_name='task_items', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_task_items_task_id'), table_name='task_items', postgresql_concurrently=True)
@@ -0,0 +1,29 @@
+"""add task_items external_id index
+
+Revision ID: d52f8a6c0b19
+Revises: a7e2c4f96d18
+Create Date: 2026-10-18 20:21:07.514362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd52f8a6c0b19'
+down_revision = 'a7e2c4f96d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Upstream callbacks find their item by external_id; built concurrently, so task_items stays writable
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_task_items_external_id'), 'task_items', ['external_id'], unique=False, postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_task_items_external_id'), table_name='task_items', postgresql_concurrently=True)
@@ -0,0 +1,24 @@
+"""add prompt_catalog_version
+
+Revision ID: f3a9d1b7c604
+Revises: d52f8a6c0b19
+Create Date: 2026-10-18 20:48:12.306419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d1b7c604'
+down_revision = 'd52f8a6c0b19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('prompt_catalog_version')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('prompt_catalog_version')))
@@ -3,10 +3,12 @@ import uuid
 from uuid import UUID
 from enum import Enum, auto
 
-from sqlalchemy import LargeBinary, bindparam
+from sqlalchemy import DateTime, JSON, LargeBinary, bindparam
 from sqlalchemy import CheckConstraint
 from sqlalchemy import Column
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy import Sequence
 from sqlalchemy import Table
 from sqlalchemy import text
 from sqlalchemy import UniqueConstraint
@@ -23,6 +25,8 @@ from sqlalchemy.ext.associationproxy import AssociationProxy
 from sqlalchemy_service import Base
 
 sql_utcnow = text('(now() at time zone \'utc\')')
+# Bumped on every model catalog change, so all workers report the same catalog version
+prompt_catalog_version = Sequence('prompt_catalog_version', metadata=Base.metadata)
 
 
 class BaseMixin:
@@ -47,26 +51,61 @@ class TaskType(Enum):
     video = 'video'
 
 
+class DispatchKind(Enum):
+    image = 'image'
+    image_to_image = 'image_to_image'
+    video = 'video'
+
+
+class DispatchStatus(Enum):
+    pending = 'pending'
+    processing = 'processing'
+    dead = 'dead'
+
+
 class TaskItem(Base):
     __tablename__ = "task_items"
+    __table_args__ = (
+        Index(
+            'ix_task_items_queued', 'task_id',
+            postgresql_include=['next_poll_at'],
+            postgresql_where=text("status = 'queued'")
+        ),
+    )
 
     id: M[int] = column(primary_key=True, index=True, autoincrement=True)
-    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"))
+    task_id: M[UUID] = column(ForeignKey('tasks.id', ondelete="CASCADE"), index=True)
     status: M[TaskStatus] = column(server_default='queued')
     result_url: M[str | None]
-    external_id: M[UUID]
+    external_id: M[UUID] = column(index=True)
+    next_poll_at: M[dt.datetime | None] = column(nullable=True)
+    poll_attempts: M[int] = column(server_default='0', default=0)
 
     task: M['Task'] = relationship(back_populates='items')
 
 
 class Task(BaseMixin, Base):
+    __table_args__ = (
+        Index('ix_tasks_created_at', 'created_at'),
+        Index('ix_tasks_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_tasks_app_bundle_created_at', 'app_bundle', 'created_at'),
+        Index('ix_tasks_user_id_trgm', 'user_id', postgresql_using='gin', postgresql_ops={'user_id': 'gin_trgm_ops'}),
+        Index(
+            'ix_tasks_app_bundle_trgm', 'app_bundle',
+            postgresql_using='gin', postgresql_ops={'app_bundle': 'gin_trgm_ops'}
+        ),
+        Index('ix_tasks_priority_id', text('priority DESC'), 'id'),
+    )
+
     error: M[str | None] = column(nullable=True)
     type: M[TaskType]
     user_id: M[str]
     app_bundle: M[str]
+    # Higher goes to upstream and gets polled first
+    priority: M[int] = column(server_default='0', default=0)
 
-    items: M[list['TaskItem']] = relationship(back_populates='task', lazy='selectin')
-    images: M[list['TaskImage']] = relationship(back_populates="task", lazy='selectin')
+    items: M[list['TaskItem']] = relationship(back_populates='task', lazy='raise_on_sql', passive_deletes=True)
+    images: M[list['TaskImage']] = relationship(back_populates="task", lazy='raise_on_sql', passive_deletes=True)
 
 
 class Prompt(BaseMixin, Base):
@@ -76,11 +115,76 @@ class Prompt(BaseMixin, Base):
     for_image: M[bool]
     for_video: M[bool]
     image: M[bytes | None] = column(type_=LargeBinary, nullable=True)
+    image_hash: M[str | None] = column(nullable=True)
 
 
 class TaskImage(BaseMixin, Base):
     external_id: M[str]
-    task_id: M[UUID] = column(ForeignKey("tasks.id", ondelete="CASCADE"))
+    task_id: M[UUID] = column(ForeignKey("tasks.id", ondelete="CASCADE"), index=True)
+    content_hash: M[str | None] = column(nullable=True, index=True)
 
     task: M['Task'] = relationship(back_populates='images')
 
+
+class TaskDispatch(BaseMixin, Base):
+    """Outbox row for starting the upstream generation of a task. Deleted once started"""
+    __tablename__ = "task_dispatches"
+    __table_args__ = (
+        Index('ix_task_dispatches_due', 'next_attempt_at', postgresql_where=text("status <> 'dead'")),
+    )
+
+    task_id: M[UUID] = column(ForeignKey("tasks.id", ondelete="CASCADE"), index=True)
+    kind: M[DispatchKind]
+    status: M[DispatchStatus] = column(server_default='pending', default=DispatchStatus.pending)
+    payload: M[dict] = column(JSON)
+    file_path: M[str | None]
+    file_hash: M[str | None]
+    attempts: M[int] = column(server_default='0', default=0)
+    next_attempt_at: M[dt.datetime] = column(server_default=sql_utcnow)
+    last_error: M[str | None]
+
+    task: M['Task'] = relationship()
+
+
+class IdempotencyKey(BaseMixin, Base):
+    """Idempotency-Key of a task creation request, replays return the task created by the first one"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint('app_bundle', 'key', name='uq_idempotency_keys_app_bundle_key'),
+    )
+
+    key: M[str]
+    app_bundle: M[str]
+    request_hash: M[str]
+    task_id: M[UUID] = column(ForeignKey("tasks.id", ondelete="CASCADE"), index=True)
+    expires_at: M[dt.datetime] = column(index=True)
+
+
+class ApiToken(BaseMixin, Base):
+    """API token registered in the database, only its sha256 is stored"""
+    token_hash: M[str] = column(unique=True)
+    title: M[str | None]
+    app_bundle: M[str | None]
+    tier: M[str] = column(server_default='default', default='default')
+    trusted: M[bool] = column(server_default=false(), default=False)
+    is_active: M[bool] = column(server_default=text('true'), default=True)
+
+
+def archive_table(table: Table) -> Table:
+    """Cold copy of `table` without constraints, filled by the compaction job"""
+    return Table(
+        f'{table.name}_archive', Base.metadata,
+        *[
+            Column(
+                c.name, c.type, primary_key=c.primary_key, autoincrement=False,
+                index=c.name == 'task_id', nullable=c.nullable
+            )
+            for c in table.columns
+        ],
+        Column('archived_at', DateTime, server_default=sql_utcnow, nullable=False),
+    )
+
+
+tasks_archive = archive_table(Task.__table__)
+task_items_archive = archive_table(TaskItem.__table__)
+task_images_archive = archive_table(TaskImage.__table__)
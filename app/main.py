@@ -8,10 +8,23 @@ from loguru import logger
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from contextlib import asynccontextmanager
-from app.services.task import TaskService
+from app.services.poller import task_poller
+from app.services.archiver import task_archiver
+from app.services.sweeper import idempotency_key_sweeper
+from app.repositories.external import ExternalRepository
+from app.repositories.lease import leader_lease
+from app.repositories.listener import pg_listener
+from app.repositories.prompt import PromptRepository
+from app.repositories.task_item import TaskItemRepository
+from app.services.dispatcher import task_dispatcher
+from app.services import image_variants
+from app.services.notifier import task_status_hub
+from app.services.api_token import api_token_registry
 from fastapi_utils.tasks import repeat_every
 
 from app.db.admin import attach_admin_panel
+from app.middlewares import UploadSizeLimitMiddleware
+from app.repositories.spool import SpoolRepository
 
 
 class ProjectSettings(BaseSettings):
@@ -42,18 +55,52 @@ def register_cors(application):
     )
 
 
-@repeat_every(seconds=10)
+def register_upload_limit(application):
+    # Room for the other form fields and multipart boundaries on top of the file itself
+    application.add_middleware(UploadSizeLimitMiddleware, max_size=SpoolRepository.max_size + 64 * 1024)
+
+
+@repeat_every(seconds=task_poller.interval)
 async def update_tasks():
     try:
-        await TaskService.update_tasks()
+        await task_poller.tick()
+    except Exception as e:
+        logger.exception(e)
+
+
+@repeat_every(seconds=task_archiver.interval)
+async def archive_tasks():
+    try:
+        await task_archiver.run()
+    except Exception as e:
+        logger.exception(e)
+
+
+@repeat_every(seconds=idempotency_key_sweeper.interval)
+async def sweep_idempotency_keys():
+    try:
+        await idempotency_key_sweeper.run()
     except Exception as e:
         logger.exception(e)
 
 
 @asynccontextmanager
 async def lifespan(app):
+    await ExternalRepository.open_sessions()
+    await api_token_registry.refresh()
+    pg_listener.add_callback(TaskItemRepository.status_channel, task_status_hub.publish_json)
+    pg_listener.add_callback(PromptRepository.changes_channel, PromptRepository.invalidate_cache)
+    await pg_listener.start()
+    await task_dispatcher.start()
     await update_tasks()
+    await archive_tasks()
+    await sweep_idempotency_keys()
     yield
+    await task_dispatcher.stop()
+    await pg_listener.stop()
+    await leader_lease.release()
+    image_variants.shutdown()
+    await ExternalRepository.close_sessions()
 
 
 def init_web_application():
@@ -69,12 +116,17 @@ def init_web_application():
     if project_settings.LOCAL_MODE:
         register_exception(application)
         register_cors(application)
+    register_upload_limit(application)
 
     from app.routes.task import router as task_router
     from app.routes.models import router as models_router
+    from app.routes.poller import router as poller_router
+    from app.routes.callback import router as callback_router
 
     application.include_router(task_router)
     application.include_router(models_router)
+    application.include_router(poller_router)
+    application.include_router(callback_router)
 
     attach_admin_panel(application)
 
@@ -0,0 +1,45 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects multipart bodies over `max_size` bytes with 413 before the form is parsed.
+
+    Without it the whole body is received and spooled by the form parser before a route can look at it.
+    A declared Content-Length is checked up front, a body without it is counted while it is received.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    def _error(self) -> HTTPException:
+        return HTTPException(413, detail=f"Request body is larger than {self.max_size} bytes")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        if not headers.get("content-type", "").startswith("multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            error = self._error()
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise self._error()
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,11 @@
+from sqlalchemy_service import BaseService as BaseRepository
+from sqlalchemy import select
+
+from app.db.tables import ApiToken
+
+
+class ApiTokenRepository[Table: ApiToken, int](BaseRepository):
+    base_table = ApiToken
+
+    async def list_active(self) -> list[ApiToken]:
+        return list(await self.session.scalars(select(ApiToken).filter_by(is_active=True)))
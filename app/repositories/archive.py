@@ -0,0 +1,50 @@
+import datetime as dt
+from sqlalchemy_service import BaseService as BaseRepository
+from sqlalchemy import delete, exists, insert, or_, select
+from sqlalchemy.sql import TableClause
+
+from app.db.tables import (
+    DispatchStatus, Task, TaskDispatch, TaskImage, TaskItem, TaskStatus,
+    task_images_archive, task_items_archive, tasks_archive
+)
+
+
+class ArchiveRepository[Table: Task, int](BaseRepository):
+    base_table = Task
+
+    @staticmethod
+    def _settled(before: dt.datetime):
+        """Tasks which will never change again: nothing is queued or waiting for dispatch"""
+        return (
+            Task.created_at < before,
+            ~exists().where(TaskItem.task_id == Task.id, TaskItem.status == TaskStatus.queued),
+            ~exists().where(TaskDispatch.task_id == Task.id, TaskDispatch.status != DispatchStatus.dead),
+            or_(Task.error.is_not(None), exists().where(TaskItem.task_id == Task.id)),
+        )
+
+    async def _move(self, source: TableClause, target: TableClause, key, task_ids: list):
+        moved = delete(source).where(key.in_(task_ids)).returning(*source.columns).cte("moved")
+        columns = [c.name for c in source.columns]
+        await self.session.execute(
+            insert(target).from_select(columns, select(*[moved.c[name] for name in columns])).add_cte(moved)
+        )
+
+    async def archive(self, before: dt.datetime, count: int) -> int:
+        """Move up to `count` settled tasks created before `before` with their items and images
+        into the archive tables, in one transaction. Returns the number of moved tasks
+        """
+        query = (
+            select(Task.id)
+            .filter(*self._settled(before))
+            .order_by(Task.created_at)
+            .limit(count)
+            .with_for_update(of=Task, skip_locked=True)
+        )
+        task_ids = list(await self.session.scalars(query))
+        if not task_ids:
+            return 0
+        await self._move(TaskImage.__table__, task_images_archive, TaskImage.task_id, task_ids)
+        await self._move(TaskItem.__table__, task_items_archive, TaskItem.task_id, task_ids)
+        await self._move(Task.__table__, tasks_archive, Task.id, task_ids)
+        await self._commit()
+        return len(task_ids)
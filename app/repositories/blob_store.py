@@ -0,0 +1,37 @@
+import hashlib
+import os
+from pathlib import Path
+from uuid import uuid4
+
+from starlette.concurrency import run_in_threadpool
+
+
+class BlobStoreRepository:
+    """Local content-addressed file cache: blobs are stored under their sha256 hex digest"""
+    store_dir = Path(os.getenv("BLOB_STORE_DIR", "/tmp/animeapi-blobs"))
+
+    def path(self, content_hash: str) -> Path:
+        return self.store_dir / content_hash[:2] / content_hash
+
+    def variant_path(self, content_hash: str, width: int | None, image_format: str) -> Path:
+        return self.path(content_hash).with_name(f"{content_hash}.{width or 'full'}.{image_format}")
+
+    def get(self, content_hash: str) -> Path | None:
+        path = self.path(content_hash)
+        return path if path.is_file() else None
+
+    def _write(self, data: bytes) -> tuple[str, Path]:
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(content_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        return content_hash, path
+
+    async def put(self, data: bytes) -> tuple[str, Path]:
+        """Store under the sha256 of the written bytes and return it with the path.
+        Written atomically, so concurrent readers never see a partial blob
+        """
+        return await run_in_threadpool(self._write, data)
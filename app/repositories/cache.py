@@ -0,0 +1,40 @@
+import math
+import time
+from collections import OrderedDict
+
+
+class TTLCache[K, V]:
+    """In-process LRU cache with per-entry time to live"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V, ttl: float | None = None):
+        """ttl=math.inf keeps the entry until it is evicted"""
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl if ttl != math.inf else math.inf, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
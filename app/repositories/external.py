@@ -1,94 +1,272 @@
-from typing import BinaryIO
-from aiohttp import ClientSession
+import asyncio
+import random
+import math
+from typing import Awaitable, BinaryIO, Callable, Mapping
+from aiohttp import ClientError, ClientSession, ClientTimeout, FormData, TCPConnector
 import os
-import io
 from uuid import uuid4
 
 from loguru import logger
 
-from app.schemas.external import ExternalImageGeneration, ExternalVideoGeneration
+from app.repositories.cache import TTLCache
+from app.repositories.resilience import CircuitBreaker, CircuitOpenError, ExternalAPIError, RetryBudget
+from app.schemas.external import ExternalImageStatus, ExternalVideoStatus
 
 
 class ExternalRepository:
+    """Client of the image and video generation upstreams.
+
+    Every call is bounded by timeouts and guarded by the circuit breaker of its upstream.
+    Idempotent status reads are retried with jittered backoff within a retry budget;
+    starts are never retried here, the dispatcher outbox retries them.
+    Concurrent status reads of the same generation share one upstream request.
+    """
     image_api_url = os.getenv("IMAGE_API_URL")
     image_api_token = os.getenv("IMAGE_API_TOKEN")
     video_api_url = os.getenv("VIDEO_API_URL").rstrip("/")
     video_api_token = os.getenv("VIDEO_API_TOKEN")
 
+    callback_base_url = os.getenv("CALLBACK_BASE_URL", "").rstrip("/") or None
+    callback_token = os.getenv("CALLBACK_TOKEN")
+
     user_id: str = str(uuid4())
     app_bundle: str = "animeapi"
 
+    pool_size = int(os.getenv("EXTERNAL_POOL_SIZE", 100))
+    pool_size_per_host = int(os.getenv("EXTERNAL_POOL_SIZE_PER_HOST", 50))
+    keepalive_timeout = float(os.getenv("EXTERNAL_KEEPALIVE_TIMEOUT", 30))
+    dns_cache_ttl = int(os.getenv("EXTERNAL_DNS_CACHE_TTL", 300))
+
+    connect_timeout = float(os.getenv("EXTERNAL_CONNECT_TIMEOUT", 5))
+    read_timeout = float(os.getenv("EXTERNAL_READ_TIMEOUT", 30))
+    total_timeout = float(os.getenv("EXTERNAL_TOTAL_TIMEOUT", 120))
+
+    max_attempts = int(os.getenv("EXTERNAL_MAX_ATTEMPTS", 3))
+    retry_base_delay = float(os.getenv("EXTERNAL_RETRY_BASE_DELAY", 0.2))
+    retryable_statuses = frozenset({429, 500, 502, 503, 504})
+    retry_budget_ratio = float(os.getenv("EXTERNAL_RETRY_BUDGET_RATIO", 0.2))
+    retry_budget_window = float(os.getenv("EXTERNAL_RETRY_BUDGET_WINDOW", 10))
+    retry_budget_min = int(os.getenv("EXTERNAL_RETRY_BUDGET_MIN", 10))
+
+    breaker_failure_threshold = int(os.getenv("EXTERNAL_BREAKER_FAILURE_THRESHOLD", 5))
+    breaker_reset_timeout = float(os.getenv("EXTERNAL_BREAKER_RESET_TIMEOUT", 30))
+    breakers = {
+        "image": CircuitBreaker("image", breaker_failure_threshold, breaker_reset_timeout),
+        "video": CircuitBreaker("video", breaker_failure_threshold, breaker_reset_timeout),
+    }
+    retry_budgets = {
+        "image": RetryBudget(retry_budget_ratio, retry_budget_window, retry_budget_min),
+        "video": RetryBudget(retry_budget_ratio, retry_budget_window, retry_budget_min),
+    }
+
+    status_cache_ttl = float(os.getenv("EXTERNAL_STATUS_CACHE_TTL", 3))
+    status_cache: TTLCache[tuple[str, str], ExternalImageStatus | ExternalVideoStatus] = TTLCache(
+        maxsize=int(os.getenv("EXTERNAL_STATUS_CACHE_SIZE", 10000)), ttl=status_cache_ttl
+    )
+    _status_in_flight: dict[tuple[str, str], asyncio.Future] = {}
+
+    _image_session: ClientSession | None = None
+    _video_session: ClientSession | None = None
+
+    @classmethod
+    def _make_session(cls, base_url: str, token: str) -> ClientSession:
+        connector = TCPConnector(
+            limit=cls.pool_size,
+            limit_per_host=cls.pool_size_per_host,
+            keepalive_timeout=cls.keepalive_timeout,
+            ttl_dns_cache=cls.dns_cache_ttl,
+        )
+        timeout = ClientTimeout(total=cls.total_timeout, connect=cls.connect_timeout, sock_read=cls.read_timeout)
+        return ClientSession(
+            base_url=base_url, headers={"ACCESS-TOKEN": token}, connector=connector, timeout=timeout
+        )
+
+    @classmethod
+    def _get_image_session(cls) -> ClientSession:
+        if ExternalRepository._image_session is None or ExternalRepository._image_session.closed:
+            ExternalRepository._image_session = cls._make_session(cls.image_api_url, cls.image_api_token)
+        return ExternalRepository._image_session
+
+    @classmethod
+    def _get_video_session(cls) -> ClientSession:
+        if ExternalRepository._video_session is None or ExternalRepository._video_session.closed:
+            ExternalRepository._video_session = cls._make_session(cls.video_api_url, cls.video_api_token)
+        return ExternalRepository._video_session
+
+    @classmethod
+    def _get_session(cls, upstream: str) -> ClientSession:
+        return cls._get_image_session() if upstream == "image" else cls._get_video_session()
+
+    @classmethod
+    async def open_sessions(cls):
+        """Create the shared per-upstream sessions. Called once from the app lifespan"""
+        cls._get_image_session()
+        cls._get_video_session()
+
+    @classmethod
+    async def close_sessions(cls):
+        for session in (ExternalRepository._image_session, ExternalRepository._video_session):
+            if session is not None and not session.closed:
+                await session.close()
+        ExternalRepository._image_session = None
+        ExternalRepository._video_session = None
+
+    @classmethod
+    def callbacks_enabled(cls) -> bool:
+        return cls.callback_base_url is not None and cls.callback_token is not None
+
+    @classmethod
+    def _callback_params(cls, kind: str) -> dict:
+        """Upstream pushes the generation result to this url when it finishes or fails,
+        sending callback_token back in the ACCESS-TOKEN header. Both go in the request body, never in a query string
+        """
+        if not cls.callbacks_enabled():
+            return {}
+        return {"callback_url": f"{cls.callback_base_url}/api/callback/{kind}", "callback_token": cls.callback_token}
+
+    @staticmethod
+    def _parse_retry_after(value: str | None) -> float | None:
+        """Upstream hint for the next status poll, in seconds"""
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, base * 2^(attempt-1)]"""
+        return random.uniform(0, self.retry_base_delay * 2 ** (attempt - 1))
+
+    async def _request(
+            self, upstream: str, method: str, url: str, expected_status: int, idempotent: bool = False, **kwargs
+    ) -> tuple[dict, Mapping[str, str]]:
+        """Return the json body and headers of the response with `expected_status`"""
+        breaker = self.breakers[upstream]
+        budget = self.retry_budgets[upstream]
+        session = self._get_session(upstream)
+        budget.record_request()
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                async with session.request(method, url, **kwargs) as resp:
+                    if resp.status == expected_status:
+                        body = await resp.json()
+                        breaker.record_success()
+                        return body, resp.headers
+                    error = ExternalAPIError(
+                        upstream, resp.status, await resp.text(), retryable=resp.status in self.retryable_statuses
+                    )
+            except (ClientError, TimeoutError) as e:
+                error = ExternalAPIError(upstream, None, f"{type(e).__name__}: {e}", retryable=True)
+            # 4xx means upstream is alive, only retryable errors count against its circuit
+            if error.retryable:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            attempt += 1
+            if not (idempotent and error.retryable and attempt < self.max_attempts and budget.try_spend()):
+                raise error
+            logger.warning(f"Retry {method} {url} after {error}")
+            await asyncio.sleep(self._backoff(attempt))
+
+    @classmethod
+    def _store_status(cls, key: tuple[str, str], future: asyncio.Future):
+        cls._status_in_flight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        schema = future.result()
+        # Finished and invalid generations never change again
+        terminal = schema.is_finished or schema.is_invalid
+        cls.status_cache.set(key, schema, math.inf if terminal else cls.status_cache_ttl)
+
+    async def _single_flight[S: ExternalImageStatus | ExternalVideoStatus](
+            self, key: tuple[str, str], fetch: Callable[[], Awaitable[S]]
+    ) -> S:
+        """Serve from the status cache or join the request already in flight for the key"""
+        schema = self.status_cache.get(key)
+        if schema is not None:
+            return schema.model_copy()
+        future = self._status_in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._status_in_flight[key] = future
+            future.add_done_callback(lambda done: self._store_status(key, done))
+        # A cancelled waiter must not cancel the request shared with the others
+        return (await asyncio.shield(future)).model_copy()
+
     async def start_image_generate(self, prompt: str, image_size: str) -> str:
         """Return task_id"""
-        async with ClientSession(base_url=self.image_api_url, headers={"ACCESS-TOKEN": self.image_api_token}) as session:
-            resp = await session.post(
-                "/image",
-                json={
-                    "prompt": prompt,
-                    "user_id": self.user_id,
-                    "app_bundle": self.app_bundle,
-                    "image_size": image_size
-                }
-            )
-            assert resp.status == 201, await resp.text()
-            return (await resp.json())["id"]
-
-    async def start_image2image_generate(self, prompt: str, image_body: io.BytesIO, image_size; str) -> str:
+        body, _ = await self._request(
+            "image", "POST", "/image", 201,
+            json={
+                "prompt": prompt,
+                "user_id": self.user_id,
+                "app_bundle": self.app_bundle,
+                "image_size": image_size
+            } | self._callback_params("image")
+        )
+        return body["id"]
+
+    @staticmethod
+    def _file_form(file: BinaryIO, filename: str, fields: dict | None = None) -> FormData:
+        """File objects are streamed by aiohttp in chunks instead of being read into memory"""
+        form = FormData()
+        for name, value in (fields or {}).items():
+            form.add_field(name, value)
+        form.add_field("file", file, filename=filename)
+        return form
+
+    async def start_image2image_generate(self, prompt: str, image: BinaryIO, image_size: str) -> str:
         """Return task_id"""
-        async with ClientSession(base_url=self.image_api_url, headers={"ACCESS-TOKEN": self.image_api_token}) as session:
-            resp = await session.post(
-                "/image/improve",
-                params={
-                    "prompt": prompt,
-                    "user_id": self.user_id,
-                    "app_bundle": self.app_bundle,
-                    "image_size": image_size
-                },
-                data={"file": image_body}
-            )
-            assert resp.status == 201, await resp.text()
-            return (await resp.json())["id"]
-
-    async def get_image_generation(self, task_id: str) -> ExternalImageGeneration:
-        async with ClientSession(base_url=self.image_api_url, headers={"ACCESS-TOKEN": self.image_api_token}) as session:
-            resp = await session.get("/image/" + task_id)
-            assert resp.status == 200, await resp.text()
-            schema = ExternalImageGeneration.model_validate(await resp.json())
+        body, _ = await self._request(
+            "image", "POST", "/image/improve", 201,
+            params={
+                "prompt": prompt,
+                "user_id": self.user_id,
+                "app_bundle": self.app_bundle,
+                "image_size": image_size
+            },
+            data=self._file_form(image, "a.jpg", self._callback_params("image"))
+        )
+        return body["id"]
+
+    async def get_image_generation(self, task_id: str) -> ExternalImageStatus:
+        return await self._single_flight(("image", task_id), lambda: self._fetch_image_generation(task_id))
+
+    async def _fetch_image_generation(self, task_id: str) -> ExternalImageStatus:
+        body, headers = await self._request("image", "GET", "/image/" + task_id, 200, idempotent=True)
+        schema = ExternalImageStatus.model_validate(body)
+        schema.retry_after = self._parse_retry_after(headers.get("Retry-After"))
         logger.debug(f"Image API response: {schema.model_dump()}")
         return schema
 
     async def upload_image_for_video(self, image_buffer: BinaryIO) -> str:
         """Return image_id"""
-        async with ClientSession(base_url=self.video_api_url, headers={"ACCESS-TOKEN": self.video_api_token}) as session:
-            resp = await session.post(
-                "/image",
-                data={'file': image_buffer}
-            )
-            assert resp.status == 201, await resp.text()
-            logger.debug("Image uploaded")
-            return (await resp.json())["id"]
+        body, _ = await self._request("video", "POST", "/image", 201, data=self._file_form(image_buffer, "a.jpg"))
+        logger.debug("Image uploaded")
+        return body["id"]
 
     async def start_video_generate(self, prompt: str, image_id: str) -> str:
         """Return task_id"""
-        async with ClientSession(base_url=self.video_api_url, headers={"ACCESS-TOKEN": self.video_api_token}) as session:
-            resp = await session.post(
-                "/video",
-                json={
-                    "prompt": prompt,
-                    "image_url": self.video_api_url + "/image/" + image_id,
-                    "user_id": self.user_id,
-                    "app_bundle": self.app_bundle,
-                }
-            )
-            assert resp.status == 201, await resp.text()
-            logger.debug("Video generation started")
-            return (await resp.json())["id"]
-
-    async def get_video_generation(self, task_id: str) -> ExternalVideoGeneration:
-        async with ClientSession(base_url=self.video_api_url, headers={"ACCESS-TOKEN": self.video_api_token}) as session:
-            resp = await session.get("/video/" + task_id)
-            assert resp.status == 200, await resp.text()
-            schema = ExternalVideoGeneration.model_validate(await resp.json())
+        body, _ = await self._request(
+            "video", "POST", "/video", 201,
+            json={
+                "prompt": prompt,
+                "image_url": self.video_api_url + "/image/" + image_id,
+                "user_id": self.user_id,
+                "app_bundle": self.app_bundle,
+            } | self._callback_params("video")
+        )
+        logger.debug("Video generation started")
+        return body["id"]
+
+    async def get_video_generation(self, task_id: str) -> ExternalVideoStatus:
+        return await self._single_flight(("video", task_id), lambda: self._fetch_video_generation(task_id))
+
+    async def _fetch_video_generation(self, task_id: str) -> ExternalVideoStatus:
+        body, headers = await self._request("video", "GET", "/video/" + task_id, 200, idempotent=True)
+        schema = ExternalVideoStatus.model_validate(body)
+        schema.retry_after = self._parse_retry_after(headers.get("Retry-After"))
         logger.debug("Video response: " + str(schema.model_dump()))
         return schema
 
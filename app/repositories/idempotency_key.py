@@ -0,0 +1,48 @@
+import datetime as dt
+import os
+from sqlalchemy_service import BaseService as BaseRepository
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from uuid import UUID
+
+from app.db.tables import IdempotencyKey
+
+
+class IdempotencyKeyRepository[Table: IdempotencyKey, int](BaseRepository):
+    base_table = IdempotencyKey
+    ttl = float(os.getenv("IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+
+    async def get_by_key(self, app_bundle: str, key: str) -> IdempotencyKey | None:
+        """Expired but not yet swept keys are still honored"""
+        return await self.session.scalar(select(IdempotencyKey).filter_by(app_bundle=app_bundle, key=key))
+
+    async def claim(self, app_bundle: str, key: str, request_hash: str, task_id: UUID, now: dt.datetime) -> bool:
+        """Insert the key without commit. False if it is already taken by a committed request.
+        A concurrent request with the same key waits on the unique index until this transaction ends
+        """
+        query = (
+            insert(IdempotencyKey)
+            .values(
+                app_bundle=app_bundle,
+                key=key,
+                request_hash=request_hash,
+                task_id=task_id,
+                expires_at=now + dt.timedelta(seconds=self.ttl)
+            )
+            .on_conflict_do_nothing(constraint='uq_idempotency_keys_app_bundle_key')
+            .returning(IdempotencyKey.id)
+        )
+        return await self.session.scalar(query) is not None
+
+    async def delete_expired(self, now: dt.datetime, count: int) -> int:
+        expired = (
+            select(IdempotencyKey.id)
+            .filter(IdempotencyKey.expires_at <= now)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        result = await self.session.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.id.in_(expired.scalar_subquery()))
+        )
+        await self._commit()
+        return result.rowcount
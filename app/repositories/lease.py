@@ -0,0 +1,52 @@
+import asyncio
+import os
+
+import asyncpg
+from loguru import logger
+
+from app.db.connection import asyncpg_dsn
+
+
+class AdvisoryLease:
+    """Leadership lease on a postgres session-level advisory lock.
+
+    The lock is held on a dedicated connection, so postgres releases it as soon as the
+    holder process dies or loses the connection, and the next acquire() of another worker wins.
+    """
+
+    def __init__(self, key: int):
+        self.key = key
+        self._connection: asyncpg.Connection | None = None
+        self._lock = asyncio.Lock()
+        self.is_leader = False
+
+    async def _connect(self) -> asyncpg.Connection:
+        if self._connection is None or self._connection.is_closed():
+            self._connection = await asyncpg.connect(asyncpg_dsn())
+            self.is_leader = False
+        return self._connection
+
+    async def acquire(self) -> bool:
+        """Try to become (or check that we still are) the leader. Cheap enough to call every tick"""
+        async with self._lock:
+            try:
+                connection = await self._connect()
+                if self.is_leader:
+                    await connection.fetchval("SELECT 1")
+                else:
+                    self.is_leader = await connection.fetchval("SELECT pg_try_advisory_lock($1)", self.key)
+                    if self.is_leader:
+                        logger.info(f"Acquired leader lease {self.key}")
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning(f"Leader lease {self.key} lost: {e}")
+                await self.release()
+            return self.is_leader
+
+    async def release(self):
+        self.is_leader = False
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
+
+
+leader_lease = AdvisoryLease(int(os.getenv("LEADER_LOCK_KEY", 728301)))
@@ -0,0 +1,73 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import Callable
+
+import asyncpg
+from loguru import logger
+
+from app.db.connection import asyncpg_dsn
+
+
+class PostgresListener:
+    """Single dedicated asyncpg connection per worker which LISTENs on the registered channels
+    and fans NOTIFY payloads out to in-process callbacks. Reconnects when the connection is lost.
+    """
+    reconnect_delay = float(os.getenv("PG_LISTENER_RECONNECT_DELAY", 5))
+
+    def __init__(self):
+        self._callbacks: dict[str, list[Callable[[str], None]]] = defaultdict(list)
+        self._task: asyncio.Task | None = None
+        self._connection: asyncpg.Connection | None = None
+
+    def add_callback(self, channel: str, callback: Callable[[str], None]):
+        """Register callbacks before start()"""
+        self._callbacks[channel].append(callback)
+
+    def _dispatch(self, connection, pid, channel: str, payload: str):
+        for callback in self._callbacks[channel]:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.exception(e)
+
+    async def _listen(self):
+        closed = asyncio.Event()
+        self._connection = await asyncpg.connect(asyncpg_dsn())
+        self._connection.add_termination_listener(lambda connection: closed.set())
+        for channel in self._callbacks:
+            await self._connection.add_listener(channel, self._dispatch)
+        logger.info(f"Listening postgres channels: {list(self._callbacks)}")
+        await closed.wait()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+                logger.warning("Postgres listener connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                if self._connection is not None and not self._connection.is_closed():
+                    await self._connection.close()
+                self._connection = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+pg_listener = PostgresListener()
@@ -1,12 +1,64 @@
+from __future__ import annotations
+
+import os
 from sqlalchemy_service import BaseService as BaseRepository
-from sqlalchemy import select
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import defer
+from fastapi import HTTPException
 from uuid import UUID
 
-from app.db.tables import Prompt
+from app.db.tables import Prompt, prompt_catalog_version
+from app.repositories.cache import TTLCache
+from app.schemas.models import ModelListPageSchema, ModelSchema, PromptSchema
+
+# Read outside the class: its `int` type parameter shadows the builtin in the class body
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", 1024))
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", 300))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 64))
+IMAGE_HASH_CACHE_SIZE = int(os.getenv("IMAGE_HASH_CACHE_SIZE", 1024))
 
 
 class PromptRepository[Table: Prompt, int](BaseRepository):
     base_table = Prompt
+    changes_channel = "prompt_changes"
+    # Read from the prompt_catalog_version sequence on demand, None until then and after every change
+    catalog_version: int | None = None
+    _invalidations = 0
+    cache: TTLCache[tuple, PromptSchema] = TTLCache(maxsize=PROMPT_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+    # Catalog pages are keyed by client supplied cursors, so they get their own cache and can't evict prompts
+    catalog_cache: TTLCache[tuple, ModelListPageSchema] = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+    # Image hashes are looked up by the public image route, so they are kept apart from prompts too
+    image_hash_cache: TTLCache[UUID, str] = TTLCache(maxsize=IMAGE_HASH_CACHE_SIZE, ttl=PROMPT_CACHE_TTL)
+
+    @classmethod
+    def invalidate_cache(cls, *args):
+        """Also used as the callback for the postgres prompt changes channel"""
+        PromptRepository.catalog_version = None
+        PromptRepository._invalidations += 1
+        cls.cache.clear()
+        cls.catalog_cache.clear()
+        cls.image_hash_cache.clear()
+
+    async def notify_changed(self, model_id: UUID):
+        """Bump the catalog version and invalidate prompt caches of every worker"""
+        await self.session.execute(select(prompt_catalog_version.next_value()))
+        self.invalidate_cache()
+        await self.session.execute(select(func.pg_notify(self.changes_channel, str(model_id))))
+        await self._commit()
+
+    async def get_catalog_version(self) -> int:
+        version = PromptRepository.catalog_version
+        if version is not None:
+            return version
+        invalidations = PromptRepository._invalidations
+        # last_value of a sequence that was never bumped is its start value, not a version
+        version = await self.session.scalar(
+            text(f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {prompt_catalog_version.name}")
+        )
+        # A change notified during the read makes the value stale, it's read again next time
+        if invalidations == PromptRepository._invalidations:
+            PromptRepository.catalog_version = version
+        return version
 
     async def create(self, model: Prompt) -> Prompt:
         self.session.add(model)
@@ -20,11 +72,43 @@ class PromptRepository[Table: Prompt, int](BaseRepository):
             filters = {"is_model": is_model}
         return list(await self._get_list(page=page, count=count, **filters))
 
+    async def list_models(self, count: int, after: UUID | None = None, page: int = 0) -> list[ModelSchema]:
+        """Keyset-paginated by id. Offset by page is kept for old clients, when no cursor is given"""
+        query = (
+            select(Prompt.id, Prompt.title, Prompt.for_image, Prompt.for_video)
+            .filter_by(is_model=True)
+            .order_by(Prompt.id)
+            .limit(count)
+        )
+        if after is not None:
+            query = query.filter(Prompt.id > after)
+        elif page:
+            query = query.offset(page * count)
+        return [ModelSchema.model_validate(row) for row in await self.session.execute(query)]
+
     async def get(self, model_id: UUID) -> Prompt:
         return await self._get_one(
             id=model_id,
         )
 
+    async def _get_cached(self, key: tuple, query, not_found: Exception) -> PromptSchema:
+        schema = self.cache.get(key)
+        if schema is not None:
+            return schema
+        model = await self.session.scalar(query.options(defer(Prompt.image)))
+        if model is None:
+            raise not_found
+        schema = PromptSchema.model_validate(model)
+        self.cache.set(key, schema)
+        return schema
+
+    async def get_cached(self, model_id: UUID) -> PromptSchema:
+        return await self._get_cached(
+            ("id", model_id),
+            select(Prompt).filter_by(id=model_id),
+            HTTPException(status_code=404)
+        )
+
     async def update(self, model_id: UUID, **fields) -> Prompt:
         return await self._update(model_id, **fields)
 
@@ -35,17 +119,25 @@ class PromptRepository[Table: Prompt, int](BaseRepository):
         query = select(Prompt.image).filter_by(id=model_id)
         return await self.session.scalar(query)
 
-    async def get_video_basic(self) -> Prompt:
-        query = select(Prompt).filter_by(is_model=False, for_image=False, for_video=True).limit(1)
-        model = await self.session.scalar(query)
-        if model is None:
-            raise ValueError("Not found basic prompt for video. Please create it in admin panel")
-        return model
+    async def get_image_hash(self, model_id: UUID) -> str | None:
+        """Cached, so an unchanged image costs no query. Misses aren't cached: any uuid may be asked for"""
+        image_hash = self.image_hash_cache.get(model_id)
+        if image_hash is None:
+            image_hash = await self.session.scalar(select(Prompt.image_hash).filter_by(id=model_id))
+            if image_hash is not None:
+                self.image_hash_cache.set(model_id, image_hash)
+        return image_hash
 
-    async def get_image_basic(self) -> Prompt:
-        query = select(Prompt).filter_by(is_model=False, for_image=True, for_video=False).limit(1)
-        model = await self.session.scalar(query)
-        if model is None:
-            raise ValueError("Not found basic prompt for image. Please create it in admin panel")
-        return model
+    async def get_video_basic(self) -> PromptSchema:
+        return await self._get_cached(
+            ("basic", "video"),
+            select(Prompt).filter_by(is_model=False, for_image=False, for_video=True).limit(1),
+            ValueError("Not found basic prompt for video. Please create it in admin panel")
+        )
 
+    async def get_image_basic(self) -> PromptSchema:
+        return await self._get_cached(
+            ("basic", "image"),
+            select(Prompt).filter_by(is_model=False, for_image=True, for_video=False).limit(1),
+            ValueError("Not found basic prompt for image. Please create it in admin panel")
+        )
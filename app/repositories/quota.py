@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+from fastapi import HTTPException
+from limits import RateLimitItem, parse
+from limits.aio.strategies import MovingWindowRateLimiter
+from limits.storage import storage_from_string
+
+
+class QuotaRepository:
+    """Task creation quotas per user and per app bundle.
+
+    The storage is in-process by default; point QUOTA_STORAGE_URI to redis
+    (e.g. async+redis://redis:6379) so workers and replicas share the counters.
+    Tokens of a tier listed in TIER_QUOTAS ({"premium": {"user": "120/minute", "bundle": "5000/minute"}})
+    get its quotas instead of the default ones.
+    """
+    user_quota = parse(os.getenv("USER_QUOTA", "30/minute"))
+    bundle_quota = parse(os.getenv("BUNDLE_QUOTA", "600/minute"))
+    tier_quotas: dict[str, dict[str, RateLimitItem]] = {
+        tier: {scope: parse(quota) for scope, quota in quotas.items()}
+        for tier, quotas in json.loads(os.getenv("TIER_QUOTAS", "{}")).items()
+    }
+    limiter = MovingWindowRateLimiter(storage_from_string(os.getenv("QUOTA_STORAGE_URI", "async+memory://")))
+
+    async def _retry_after(self, item: RateLimitItem, *identifiers: str) -> int:
+        stats = await self.limiter.get_window_stats(item, *identifiers)
+        return max(int(stats.reset_time - time.time()) + 1, 1)
+
+    async def _exceeded(self, item: RateLimitItem, identifiers: tuple[str, ...]) -> HTTPException:
+        return HTTPException(
+            429,
+            detail=f"Task quota {item} per {identifiers[0]} is exceeded",
+            headers={"Retry-After": str(await self._retry_after(item, *identifiers))}
+        )
+
+    async def hit(self, app_bundle: str, user_id: str, tier: str = "default"):
+        """Spend one task of both quotas or raise 429.
+
+        Every hit is atomic in the storage and is trusted on its own, a test beforehand may be stale.
+        Moving window hits can't be undone, so the user quota is spent first: a user over quota
+        is rejected without spending the bundle quota. The bundle is tested beforehand only to spare
+        the user quota while the bundle is exhausted; losing the race for its last slot costs the user one task
+        """
+        quotas = self.tier_quotas.get(tier, {})
+        user_quota, user_ids = quotas.get("user", self.user_quota), ("user", app_bundle, user_id)
+        bundle_quota, bundle_ids = quotas.get("bundle", self.bundle_quota), ("bundle", app_bundle)
+        if not await self.limiter.test(bundle_quota, *bundle_ids):
+            raise await self._exceeded(bundle_quota, bundle_ids)
+        for item, identifiers in ((user_quota, user_ids), (bundle_quota, bundle_ids)):
+            if not await self.limiter.hit(item, *identifiers):
+                raise await self._exceeded(item, identifiers)
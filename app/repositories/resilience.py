@@ -0,0 +1,116 @@
+import time
+from collections import deque
+from enum import Enum
+
+
+class ExternalAPIError(Exception):
+    """Upstream call failed: unexpected status, connection error or timeout"""
+
+    def __init__(self, upstream: str, status: int | None, detail: str, retryable: bool):
+        self.upstream = upstream
+        self.status = status
+        self.detail = detail
+        self.retryable = retryable
+        super().__init__(f"{upstream} upstream failed with {status or 'no response'}: {detail}")
+
+
+class CircuitOpenError(ExternalAPIError):
+    """Upstream is considered down, the call was not made"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(upstream, None, f"circuit is open for {retry_in:.1f}s", retryable=False)
+
+
+class CircuitState(Enum):
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+
+class CircuitBreaker:
+    """Consecutive-failures circuit breaker of one upstream.
+
+    After `failure_threshold` failures in a row the circuit opens and calls fail fast
+    for `reset_timeout` seconds. Then a single probe call is let through:
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, upstream: str, failure_threshold: int, reset_timeout: float):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._probe_started_at: float | None = None
+
+    @property
+    def state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.closed
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return CircuitState.open
+        return CircuitState.half_open
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == CircuitState.open
+
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0
+        return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may go to upstream"""
+        state = self.state
+        if state == CircuitState.closed:
+            return
+        now = time.monotonic()
+        # A probe which never reported back (e.g. cancelled) doesn't block the circuit forever
+        probe_pending = self._probe_started_at is not None and now - self._probe_started_at < self.reset_timeout
+        if state == CircuitState.open or probe_pending:
+            raise CircuitOpenError(self.upstream, self.retry_in() or self.reset_timeout)
+        self._probe_started_at = now
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_started_at is not None or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._probe_started_at = None
+
+
+class RetryBudget:
+    """Caps retries to `ratio` of the requests made in the last `window` seconds,
+    plus `min_retries` per window, so retries can't multiply the load of a degraded upstream
+    """
+
+    def __init__(self, ratio: float, window: float, min_retries: int):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+
+    def _trim(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            return False
+        self._retries.append(now)
+        return True
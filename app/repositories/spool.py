@@ -0,0 +1,54 @@
+import hashlib
+import os
+from pathlib import Path
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+class SpoolRepository:
+    """Uploaded source images waiting for dispatch to upstream.
+    Dispatches keep the path until they start, so the directory must outlive the container (a volume),
+    with several replicas a shared one
+    """
+    spool_dir = Path(os.getenv("UPLOAD_SPOOL_DIR", Path.home() / "animeapi-uploads"))
+    max_size = int(os.getenv("UPLOAD_MAX_SIZE", 20 * 1024 * 1024))
+    chunk_size = 64 * 1024
+
+    def new_path(self) -> str:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        return str(self.spool_dir / uuid4().hex)
+
+    async def save_upload(self, file: UploadFile) -> tuple[str, str]:
+        """Copy the upload to the spool in chunks, never holding the whole body in memory.
+        Return the spooled path and sha256 of the content, computed on the way.
+        Oversized requests are rejected by UploadSizeLimitMiddleware before parsing, the checks here are a backstop
+        """
+        if file.size is not None and file.size > self.max_size:
+            raise HTTPException(413, detail=f"File is larger than {self.max_size} bytes")
+
+        path = self.new_path()
+        size = 0
+        digest = hashlib.sha256()
+        try:
+            with open(path, "wb") as spooled:
+                while chunk := await file.read(self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise HTTPException(413, detail=f"File is larger than {self.max_size} bytes")
+                    digest.update(chunk)
+                    await run_in_threadpool(spooled.write, chunk)
+        except BaseException:
+            self.delete(path)
+            raise
+        return path, digest.hexdigest()
+
+    @staticmethod
+    def delete(path: str | None):
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
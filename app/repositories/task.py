@@ -1,5 +1,5 @@
 from sqlalchemy_service import BaseService as BaseRepository
-from sqlalchemy import select
+from sqlalchemy import Row, and_, func, or_, select, true
 from uuid import UUID
 
 from app.db.tables import Task, TaskItem, TaskStatus
@@ -18,11 +18,47 @@ class TaskRepository[Table: Task, int](BaseRepository):
         [self.session.add(model) for model in models]
         await self._commit()
 
-    async def list_queued(self) -> list[Task]:
-        query = self._select_in_load_query([Task.items])
-        query = query.filter(Task.items.any(TaskItem.status == TaskStatus.queued))
+    async def list_queued(self, count: int | None = None, after: tuple[int, UUID] | None = None) -> list[Task]:
+        """Return tasks with queued items which are due to poll, higher priority first.
+        Keyset-paginated by (priority desc, id): pass (priority, id) of the last task of the previous chunk as `after`
+        """
+        # Materialized, so the plan starts from the partial ix_task_items_queued index: walking tasks
+        # in priority order and probing each one for queued items costs as much as the whole finished history
+        due = (
+            select(TaskItem.task_id)
+            .where(
+                TaskItem.status == TaskStatus.queued,
+                or_(TaskItem.next_poll_at.is_(None), TaskItem.next_poll_at <= func.timezone('utc', func.now()))
+            )
+            .distinct()
+            .cte("due")
+            .prefix_with("MATERIALIZED")
+        )
+        query = self._select_in_load_query([Task.items]).join(due, due.c.task_id == Task.id)
+        if after is not None:
+            priority, task_id = after
+            query = query.filter(or_(Task.priority < priority, and_(Task.priority == priority, Task.id > task_id)))
+        query = query.order_by(Task.priority.desc(), Task.id).limit(count)
         return list(await self.session.scalars(query))
 
+    async def list_statuses(self, task_ids: list[UUID]) -> list[Row]:
+        """One query for (id, error, status, result_url) of tasks with their latest item.
+        status and result_url are None for tasks without items
+        """
+        latest_item = (
+            select(TaskItem.status, TaskItem.result_url)
+            .where(TaskItem.task_id == Task.id)
+            .order_by(TaskItem.id.desc())
+            .limit(1)
+            .lateral()
+        )
+        query = (
+            select(Task.id, Task.error, latest_item.c.status, latest_item.c.result_url)
+            .outerjoin(latest_item, true())
+            .where(Task.id.in_(task_ids))
+        )
+        return list(await self.session.execute(query))
+
     async def list(self, page=None, count=None) -> list[Task]:
         return list(await self._get_list(page=page, count=count))
 
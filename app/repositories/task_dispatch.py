@@ -0,0 +1,88 @@
+import datetime as dt
+from sqlalchemy_service import BaseService as BaseRepository
+from sqlalchemy import Float, case, cast, delete, func, literal, select, update
+from uuid import UUID
+
+from app.db.tables import DispatchStatus, Task, TaskDispatch
+
+
+class TaskDispatchRepository[Table: TaskDispatch, int](BaseRepository):
+    base_table = TaskDispatch
+
+    def add(self, model: TaskDispatch):
+        """Stage the dispatch, it is committed together with its task"""
+        self.session.add(model)
+
+    async def claim(
+            self, count: int, now: dt.datetime, lease_until: dt.datetime, bundle_weights: dict[str, float] | None = None
+    ) -> list[TaskDispatch]:
+        """Lock due dispatches for this worker. Rows of a crashed worker become due again after lease_until.
+        App bundles take turns (weighted round-robin), so the backlog of one bundle can't starve the others:
+        the n-th due dispatch of a bundle with weight w goes in turn n / w.
+        Turns are taken within a task priority, higher priorities go first
+        """
+        weight = case(bundle_weights, value=Task.app_bundle, else_=1.0) if bundle_weights else literal(1.0)
+        turn = func.row_number().over(
+            partition_by=(Task.priority, Task.app_bundle), order_by=TaskDispatch.next_attempt_at
+        )
+        ranked = (
+            select(TaskDispatch.id, Task.priority, (turn / cast(weight, Float)).label("turn"))
+            .join(Task, Task.id == TaskDispatch.task_id)
+            .filter(TaskDispatch.status != DispatchStatus.dead, TaskDispatch.next_attempt_at <= now)
+            .subquery()
+        )
+        due = (
+            select(TaskDispatch.id)
+            .join(ranked, ranked.c.id == TaskDispatch.id)
+            .order_by(ranked.c.priority.desc(), ranked.c.turn, TaskDispatch.next_attempt_at)
+            .limit(count)
+            .with_for_update(of=TaskDispatch, skip_locked=True)
+        )
+        query = (
+            update(TaskDispatch)
+            .where(TaskDispatch.id.in_(due.scalar_subquery()))
+            .values(
+                status=DispatchStatus.processing,
+                attempts=TaskDispatch.attempts + 1,
+                next_attempt_at=lease_until
+            )
+            .returning(TaskDispatch)
+            .execution_options(synchronize_session=False)
+        )
+        models = list(await self.session.scalars(query))
+        await self._commit()
+        return models
+
+    async def retry(self, model_id: UUID, error: str, next_attempt_at: dt.datetime):
+        await self.session.execute(
+            update(TaskDispatch)
+            .filter_by(id=model_id)
+            .values(status=DispatchStatus.pending, last_error=error, next_attempt_at=next_attempt_at)
+        )
+        await self._commit()
+
+    async def postpone(self, model_id: UUID, error: str, next_attempt_at: dt.datetime):
+        """Retry later without counting the attempt, it never reached upstream"""
+        await self.session.execute(
+            update(TaskDispatch)
+            .filter_by(id=model_id)
+            .values(
+                status=DispatchStatus.pending,
+                attempts=TaskDispatch.attempts - 1,
+                last_error=error,
+                next_attempt_at=next_attempt_at
+            )
+        )
+        await self._commit()
+
+    async def mark_dead(self, model_id: UUID, error: str):
+        await self.session.execute(
+            update(TaskDispatch)
+            .filter_by(id=model_id)
+            .values(status=DispatchStatus.dead, last_error=error)
+        )
+        await self._commit()
+
+    async def stage_delete(self, model_id: UUID):
+        """Delete without commit, so the removal is committed together with the started task item"""
+        await self.session.execute(delete(TaskDispatch).filter_by(id=model_id))
@@ -1,4 +1,6 @@
+import datetime as dt
 from sqlalchemy_service import BaseService as BaseRepository
+from sqlalchemy import select
 from uuid import UUID
 
 from app.db.tables import TaskImage
@@ -21,6 +23,16 @@ class TaskImageRepository[Table: TaskImage, int](BaseRepository):
             id=model_id,
         )
 
+    async def find_external_id(self, content_hash: str, since: dt.datetime) -> str | None:
+        """Upstream id of the latest image with the same content uploaded after `since`"""
+        query = (
+            select(TaskImage.external_id)
+            .filter(TaskImage.content_hash == content_hash, TaskImage.created_at >= since)
+            .order_by(TaskImage.created_at.desc())
+            .limit(1)
+        )
+        return await self.session.scalar(query)
+
     async def update(self, model_id: UUID, **fields) -> TaskImage:
         return await self._update(model_id, **fields)
 
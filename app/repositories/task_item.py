@@ -1,12 +1,16 @@
+from __future__ import annotations
+
 from sqlalchemy_service import BaseService as BaseRepository
-from sqlalchemy import select
+from sqlalchemy import ARRAY, DateTime, Integer, String, bindparam, cast, column, func, select, text, update, values
 from uuid import UUID
 
-from app.db.tables import TaskItem
+from app.db.tables import TaskItem, TaskStatus
+from app.schemas.task import TaskItemStatusUpdateSchema, TaskSchema
 
 
 class TaskItemRepository[Table: TaskItem, int](BaseRepository):
     base_table = TaskItem
+    status_channel = "task_status"
 
     async def create(self, model: TaskItem) -> TaskItem:
         self.session.add(model)
@@ -22,8 +26,103 @@ class TaskItemRepository[Table: TaskItem, int](BaseRepository):
             id=model_id,
         )
 
+    async def get_by_external_id(self, external_id: UUID) -> TaskItem:
+        return await self._get_one(
+            external_id=external_id,
+        )
+
+    async def notify_status(self, schema: TaskSchema):
+        """NOTIFY is delivered to the listeners of every worker on commit"""
+        await self.session.execute(select(func.pg_notify(self.status_channel, schema.model_dump_json())))
+
+    async def notify_statuses(self, schemas: list[TaskSchema]):
+        if not schemas:
+            return
+        query = text(
+            "SELECT pg_notify(:channel, payload) FROM unnest(:payloads) AS payload"
+        ).bindparams(bindparam("payloads", type_=ARRAY(String)))
+        await self.session.execute(query, {
+            "channel": self.status_channel,
+            "payloads": [schema.model_dump_json() for schema in schemas]
+        })
+
+    async def bulk_update(self, updates: list[TaskItemStatusUpdateSchema]):
+        """Apply polled statuses with one UPDATE ... FROM (VALUES ...) and one commit.
+        Items which left the queue meanwhile (e.g. by an upstream callback) are not touched.
+        VALUES columns are cast explicitly: a column which is NULL in every row is typed as text otherwise
+        """
+        if not updates:
+            return
+        rows = values(
+            column("id", Integer),
+            column("status", String),
+            column("result_url", String),
+            column("next_poll_at", DateTime),
+            column("poll_attempts", Integer),
+            name="polled"
+        ).data([
+            (item.item_id, item.status.value, item.result_url, item.next_poll_at, item.poll_attempts)
+            for item in updates
+        ])
+        query = (
+            update(TaskItem)
+            .where(TaskItem.id == rows.c.id, TaskItem.status == TaskStatus.queued)
+            .values(
+                status=cast(rows.c.status, TaskItem.status.type),
+                result_url=cast(rows.c.result_url, String),
+                next_poll_at=cast(rows.c.next_poll_at, DateTime),
+                poll_attempts=cast(rows.c.poll_attempts, Integer)
+            )
+            .returning(TaskItem.id)
+            .execution_options(synchronize_session=False)
+        )
+        updated_ids = set(await self.session.scalars(query))
+        await self.notify_statuses([
+            TaskSchema(
+                id=item.task_id,
+                status=item.status,
+                result_url=(item.result_url if item.status == TaskStatus.finished else None)
+            )
+            for item in updates
+            if item.status != TaskStatus.queued and item.item_id in updated_ids
+        ])
+        await self._commit()
+
+    async def settle_queued(self, external_id: UUID, status: TaskStatus, **fields) -> bool:
+        """Set the final status of a still queued item and commit. The queued check is in the UPDATE itself,
+        so a callback and a poll batch settling the same item can't both write. Return whether the item was updated
+        """
+        query = (
+            update(TaskItem)
+            .where(TaskItem.external_id == external_id, TaskItem.status == TaskStatus.queued)
+            .values(status=status, **fields)
+            .returning(TaskItem.task_id, TaskItem.result_url)
+            .execution_options(synchronize_session=False)
+        )
+        row = (await self.session.execute(query)).one_or_none()
+        if row is not None:
+            await self.notify_status(TaskSchema(
+                id=row.task_id,
+                status=status,
+                result_url=(row.result_url if status == TaskStatus.finished else None)
+            ))
+        await self._commit()
+        return row is not None
+
     async def update(self, model_id: int, **fields) -> TaskItem:
-        return await self._update(model_id, **fields)
+        if "status" not in fields:
+            return await self._update(model_id, **fields)
+
+        obj = await self._get_one(id=model_id)
+        result_url = fields.get("result_url", obj.result_url)
+        await self.notify_status(TaskSchema(
+            id=obj.task_id,
+            status=fields["status"],
+            result_url=(result_url if fields["status"] == TaskStatus.finished else None)
+        ))
+        obj = await self._update_obj(obj, **fields)
+        await self.session.refresh(obj)
+        return obj
 
     async def delete(self, model_id: UUID):
         await self._delete(model_id)
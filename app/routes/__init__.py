@@ -1,9 +1,46 @@
-import os
-from fastapi import Header, HTTPException
+import hmac
+from fastapi import Depends, Header, HTTPException, Request
 
-api_tokens = os.getenv("API_TOKEN", "123").split(',')
+from app.repositories.external import ExternalRepository
+from app.schemas.api_token import ApiTokenSchema
+from app.services.api_token import api_token_registry
 
 
-def validate_api_token(api_token: str = Header()):
-    if api_token not in api_tokens:
+async def validate_api_token(request: Request, api_token: str = Header()) -> ApiTokenSchema:
+    """Token metadata is also kept in request.state for handlers which don't depend on it directly"""
+    metadata = await api_token_registry.get(api_token)
+    if metadata is None:
+        raise HTTPException(401)
+    request.state.api_token = metadata
+    return metadata
+
+
+def get_api_token(request: Request) -> ApiTokenSchema | None:
+    """Metadata of the token checked by validate_api_token, None on routes without it"""
+    return getattr(request.state, "api_token", None)
+
+
+def task_priority(
+        api_token: ApiTokenSchema = Depends(validate_api_token),
+        x_task_priority: int | None = Header(None, ge=-100, le=100)
+) -> int | None:
+    """Priority requested for the task, only trusted tokens may set it"""
+    if x_task_priority is None:
+        return None
+    if not api_token.trusted:
+        raise HTTPException(403, detail="Token is not allowed to set X-Task-Priority")
+    return x_task_priority
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def validate_callback_token(access_token: str | None = Header(None)):
+    """Upstream passes the token back in ACCESS-TOKEN header, a query string would leak it to access logs"""
+    callback_token = ExternalRepository.callback_token
+    if callback_token is None or access_token is None or not hmac.compare_digest(access_token, callback_token):
         raise HTTPException(401)
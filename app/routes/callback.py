@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends
+
+from app.routes import validate_callback_token
+from app.schemas.external import ExternalImageGeneration, ExternalVideoGeneration
+from app.services.task import TaskService
+
+router = APIRouter(prefix="/api/callback", tags=["Upstream callback"])
+
+
+@router.post(
+    "/image",
+    status_code=204,
+    dependencies=[Depends(validate_callback_token)],
+    description="Уведомление от сервиса генерации изображений о завершении или ошибке генерации"
+)
+async def image_callback(
+        schema: ExternalImageGeneration,
+        service: TaskService = Depends()
+):
+    await service.handle_image_callback(schema)
+
+
+@router.post(
+    "/video",
+    status_code=204,
+    dependencies=[Depends(validate_callback_token)],
+    description="Уведомление от сервиса генерации видео о завершении или ошибке генерации"
+)
+async def video_callback(
+        schema: ExternalVideoGeneration,
+        service: TaskService = Depends()
+):
+    await service.handle_video_callback(schema)
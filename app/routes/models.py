@@ -1,29 +1,67 @@
-from fastapi import APIRouter, Depends, Response
+import os
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import FileResponse
 from uuid import UUID
 
-from app.routes import validate_api_token
-from app.schemas.models import ModelSearchSchema, ModelSchema
+from app.routes import etag_matches, validate_api_token
+from app.schemas.models import ImageFormat, ModelSearchSchema, ModelSchema
 from app.services.models import ModelsService
 
 router = APIRouter(prefix="/api/models", tags=["Models"])
+image_max_age = int(os.getenv("MODEL_IMAGE_MAX_AGE", 86400))
+# Previews are resized only to these widths, so requests can't make a variant of every width
+image_widths = sorted(int(width) for width in os.getenv("MODEL_IMAGE_WIDTHS", "64,128,256,512,1024,2048").split(","))
+
+
+def snap_width(width: int) -> int:
+    """The smallest allowed width which is not less than the requested one"""
+    return next(allowed for allowed in image_widths if allowed >= width)
 
 
 @router.get(
     "",
     response_model=list[ModelSchema],
-    dependencies=[Depends(validate_api_token)]
+    dependencies=[Depends(validate_api_token)],
+    description="Список моделей. Постраничный вывод по курсору: after - значение заголовка X-Next-Cursor предыдущей страницы"
 )
 async def list_models(
         schema: ModelSearchSchema = Depends(),
+        if_none_match: str | None = Header(None),
         service: ModelsService = Depends()
 ):
-    return await service.list(schema)
+    page = await service.list(schema)
+    headers = {"ETag": page.etag, "X-Catalog-Version": str(page.version)}
+    if page.next_cursor is not None:
+        headers["X-Next-Cursor"] = str(page.next_cursor)
+    if etag_matches(if_none_match, page.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
 
 
 @router.get(
     "/{model_id}/image",
-    response_class=Response
+    response_class=Response,
+    description=(
+        "Превью модели. width - уменьшить до ширины, округляется вверх до ближайшей из MODEL_IMAGE_WIDTHS, "
+        "format - перекодировать (по умолчанию webp, если задан width)"
+    )
 )
-async def get_model_image(model_id: UUID, service: ModelsService = Depends()):
-    image = await service.get_image(model_id)
-    return Response(content=image, media_type="image/png")
+async def get_model_image(
+        model_id: UUID,
+        width: int | None = Query(None, ge=1, le=image_widths[-1]),
+        image_format: ImageFormat | None = Query(None, alias="format"),
+        if_none_match: str | None = Header(None),
+        service: ModelsService = Depends()
+):
+    if width is not None:
+        width = snap_width(width)
+        if image_format is None:
+            image_format = ImageFormat.webp
+    image_hash = await service.get_image_hash(model_id)
+    variant = f"-{width or 'full'}-{image_format.value}" if image_format is not None else ""
+    headers = {"ETag": f'"{image_hash}{variant}"', "Cache-Control": f"public, max-age={image_max_age}"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    path, media_type, image_hash = await service.get_image(image_hash, model_id, width, image_format)
+    headers["ETag"] = f'"{image_hash}{variant}"'
+    return FileResponse(path, media_type=media_type, headers=headers)
@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends
+
+from app.routes import validate_api_token
+from app.schemas.poller import PollerMetricsSchema
+from app.services.poller import task_poller
+
+router = APIRouter(prefix="/api/poller", tags=["Poller"])
+
+
+@router.get(
+    "/metrics",
+    response_model=PollerMetricsSchema,
+    dependencies=[Depends(validate_api_token)],
+    description="Метрики фонового опроса статусов задач: длительность тика и размер очереди"
+)
+async def get_poller_metrics():
+    return task_poller.metrics
@@ -1,12 +1,22 @@
 from uuid import UUID
-from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File
+from fastapi import APIRouter, Depends, UploadFile, File, Header, Query
+from fastapi.responses import StreamingResponse
 
-from app.routes import validate_api_token
+from app.routes import get_api_token, task_priority, validate_api_token
+from app.services.dispatcher import task_dispatcher
 from app.services.task import TaskService
-from app.schemas.task import TaskVideoCreateSchema, TaskImageCreateSchema, TaskSchema
+from app.schemas.api_token import ApiTokenSchema
+from app.schemas.task import TaskVideoCreateSchema, TaskImageCreateSchema, TaskSchema, TaskStatusBatchSchema
 
 router = APIRouter(prefix="/api/task", tags=["Animate task"])
 
+idempotency_key_header = Header(
+    None,
+    alias="Idempotency-Key",
+    max_length=255,
+    description="Повтор запроса с тем же ключом вернет уже созданную задачу вместо новой генерации"
+)
+
 
 @router.post(
     "/image",
@@ -16,11 +26,13 @@ router = APIRouter(prefix="/api/task", tags=["Animate task"])
 )
 async def generate_image(
         schema: TaskImageCreateSchema,
-        background_tasks: BackgroundTasks,
+        idempotency_key: str | None = idempotency_key_header,
+        priority: int | None = Depends(task_priority),
+        api_token: ApiTokenSchema = Depends(get_api_token),
         service: TaskService = Depends()
 ):
-    model = await service.create_image(schema)
-    background_tasks.add_task(service.start_image, model.id, schema)
+    model = await service.create_image(schema, idempotency_key, priority, api_token)
+    task_dispatcher.wake()
     return model
 
 
@@ -31,13 +43,15 @@ async def generate_image(
     description="Создание задачи на генерацию аниме-изображения, исходя из предпочтений пользователя(prompt+immage). model_id - необязательное, брать из списка моделей"
 )
 async def generate_image_from_image(
-        background_tasks: BackgroundTasks,
         file: UploadFile = File(),
         schema: TaskImageCreateSchema = Depends(),
+        idempotency_key: str | None = idempotency_key_header,
+        priority: int | None = Depends(task_priority),
+        api_token: ApiTokenSchema = Depends(get_api_token),
         service: TaskService = Depends()
 ):
-    model = await service.create_image(schema)
-    background_tasks.add_task(service.start_image_to_image, model.id, await file.read(), schema)
+    model = await service.create_image_to_image(schema, file, idempotency_key, priority, api_token)
+    task_dispatcher.wake()
     return model
 
 
@@ -49,24 +63,57 @@ async def generate_image_from_image(
 )
 async def generate_video(
         schema: TaskVideoCreateSchema,
-        background_tasks: BackgroundTasks,
         file: UploadFile = File(),
+        idempotency_key: str | None = idempotency_key_header,
+        priority: int | None = Depends(task_priority),
+        api_token: ApiTokenSchema = Depends(get_api_token),
         service: TaskService = Depends()
 ):
-    model = await service.create_video(schema, file)
-    background_tasks.add_task(service.start_video, model.id, schema)
+    model = await service.create_video(schema, file, idempotency_key, priority, api_token)
+    task_dispatcher.wake()
     return model
 
 
+@router.post(
+    "/status",
+    response_model=dict[UUID, TaskSchema],
+    dependencies=[Depends(validate_api_token)],
+    description="Статусы нескольких задач одним запросом. Неизвестные id в ответ не попадают"
+)
+async def get_task_statuses(
+        schema: TaskStatusBatchSchema,
+        service: TaskService = Depends()
+):
+    return await service.get_many(schema.ids)
+
+
 @router.get(
     "/{task_id}",
     response_model=TaskSchema,
     dependencies=[Depends(validate_api_token)],
-    description="Получение статуса и ссылки на результат генерации"
+    description="Получение статуса и ссылки на результат генерации. "
+                "wait - сколько секунд ждать смены статуса, если задача еще в очереди"
 )
 async def get_task_status(
         task_id: UUID,
+        wait: float = Query(0, ge=0, le=60),
         service: TaskService = Depends()
 ):
+    if wait:
+        return await service.wait(task_id, wait)
     return await service.get(task_id)
 
+
+@router.get(
+    "/{task_id}/events",
+    response_class=StreamingResponse,
+    dependencies=[Depends(validate_api_token)],
+    description="Поток Server-Sent Events со статусом задачи, закрывается после завершения генерации"
+)
+async def stream_task_status(
+        task_id: UUID,
+        service: TaskService = Depends()
+):
+    events = await service.stream(task_id)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
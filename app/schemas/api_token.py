@@ -0,0 +1,10 @@
+from pydantic import BaseModel, ConfigDict
+
+
+class ApiTokenSchema(BaseModel):
+    """Metadata of an API token, available to handlers after validate_api_token"""
+    app_bundle: str | None = None
+    tier: str = "default"
+    trusted: bool = False
+
+    model_config = ConfigDict(from_attributes=True)
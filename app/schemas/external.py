@@ -15,3 +15,16 @@ class ExternalVideoGeneration(BaseModel):
     is_finished: bool
     is_invalid: bool
 
+
+class ExternalImageStatus(ExternalImageGeneration):
+    """Polled generation status, retry_after is the poll hint from the Retry-After header.
+    Not a part of the callback body
+    """
+    retry_after: float | None = None
+
+
+class ExternalVideoStatus(ExternalVideoGeneration):
+    """Polled generation status, retry_after is the poll hint from the Retry-After header.
+    Not a part of the callback body
+    """
+    retry_after: float | None = None
@@ -1,5 +1,6 @@
+from enum import Enum
 from uuid import UUID
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ModelSchema(BaseModel):
@@ -11,7 +12,27 @@ class ModelSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PromptSchema(ModelSchema):
+    """Prompt without the image blob, safe to keep in memory"""
+    text: str
+    is_model: bool
+
+
 class ModelSearchSchema(BaseModel):
-    page: int = 0
-    count: int = 100
+    after: UUID | None = None
+    page: int = Field(0, ge=0)
+    count: int = Field(100, ge=1, le=100)
+
+
+class ModelListPageSchema(BaseModel):
+    """Serialized page of the model catalog, cached until the catalog changes"""
+    body: bytes
+    etag: str
+    next_cursor: UUID | None = None
+    version: int
+
 
+class ImageFormat(Enum):
+    png = "png"
+    jpeg = "jpeg"
+    webp = "webp"
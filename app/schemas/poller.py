@@ -0,0 +1,15 @@
+import datetime as dt
+from pydantic import BaseModel
+
+
+class PollerMetricsSchema(BaseModel):
+    is_leader: bool = False
+    ticks_total: int = 0
+    ticks_skipped: int = 0
+    last_tick_started_at: dt.datetime | None = None
+    last_tick_duration: float | None = None
+    backlog_size: int = 0
+    in_flight: int = 0
+    errors_total: int = 0
+    polls_skipped: int = 0
+    open_circuits: list[str] = []
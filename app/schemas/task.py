@@ -1,6 +1,7 @@
+import datetime as dt
 from enum import Enum
 from uuid import UUID
-from pydantic import BaseModel, ConfigDict, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 from app.db.tables import TaskStatus
 import json
 
@@ -14,6 +15,20 @@ class TaskSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class TaskItemStatusUpdateSchema(BaseModel):
+    """Result of one status poll, written back in bulk"""
+    item_id: int
+    task_id: UUID
+    status: TaskStatus
+    result_url: str | None = None
+    next_poll_at: dt.datetime | None = None
+    poll_attempts: int
+
+
+class TaskStatusBatchSchema(BaseModel):
+    ids: list[UUID] = Field(max_length=1000)
+
+
 class ImageSize(Enum):
     square_hd = "square_hd"
     square = "square"
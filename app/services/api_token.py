@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+
+from loguru import logger
+
+from app.repositories.api_token import ApiTokenRepository
+from app.schemas.api_token import ApiTokenSchema
+
+
+class ApiTokenRegistry:
+    """API tokens keyed by their sha256.
+
+    Tokens from the API_TOKEN env (comma separated) are always valid, TRUSTED_API_TOKENS of them
+    may set task priorities. With API_TOKEN_REFRESH_INTERVAL > 0 active tokens of the api_tokens table
+    are merged in and reloaded at most once per interval; a failed reload keeps the previous registry.
+    Only the first load is awaited, a stale registry keeps serving lookups while it's reloaded in the background.
+    Lookup hashes the presented token first, so its time doesn't depend on how much of a stored token matches.
+    """
+    refresh_interval = float(os.getenv("API_TOKEN_REFRESH_INTERVAL", 0))
+
+    def __init__(self, tokens: list[str], trusted_tokens: set[str]):
+        self._static = {
+            self.hash(token): ApiTokenSchema(trusted=token in trusted_tokens) for token in tokens
+        }
+        self._tokens = dict(self._static)
+        self._loaded_at = -math.inf
+        self._reloading: asyncio.Task | None = None
+
+    @staticmethod
+    def hash(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _is_fresh(self) -> bool:
+        return time.monotonic() - self._loaded_at < self.refresh_interval
+
+    async def _reload(self):
+        try:
+            async with ApiTokenRepository() as repository:
+                models = await repository.list_active()
+            self._tokens = self._static | {
+                model.token_hash: ApiTokenSchema.model_validate(model) for model in models
+            }
+        except Exception as e:
+            logger.exception(e)
+        self._loaded_at = time.monotonic()
+
+    async def refresh(self):
+        if not self.refresh_interval or self._is_fresh():
+            return
+        if self._reloading is None or self._reloading.done():
+            self._reloading = asyncio.create_task(self._reload())
+        if self._loaded_at == -math.inf:
+            # Nothing is loaded yet; shielded, so a cancelled request doesn't cancel the shared load
+            await asyncio.shield(self._reloading)
+
+    async def get(self, token: str) -> ApiTokenSchema | None:
+        await self.refresh()
+        return self._tokens.get(self.hash(token))
+
+
+api_token_registry = ApiTokenRegistry(
+    tokens=list(filter(None, os.getenv("API_TOKEN", "123").split(','))),
+    trusted_tokens=set(filter(None, os.getenv("TRUSTED_API_TOKENS", "").split(',')))
+)
@@ -0,0 +1,39 @@
+import datetime as dt
+import os
+
+from loguru import logger
+
+from app.repositories.archive import ArchiveRepository
+from app.repositories.lease import leader_lease
+from app.services.schedule import utcnow
+
+
+class TaskArchiver:
+    """Moves settled tasks older than `retention_days` to the *_archive tables.
+
+    Work is done in transactions of `batch_size` tasks and at most `max_batches` per run,
+    so a large backlog is drained over several runs instead of one long lock-holding job.
+    Only the leader compacts.
+    """
+    retention_days = float(os.getenv("ARCHIVE_RETENTION_DAYS", 30))
+    batch_size = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+    max_batches = int(os.getenv("ARCHIVE_MAX_BATCHES", 20))
+    interval = float(os.getenv("ARCHIVE_INTERVAL", 600))
+
+    async def run(self) -> int:
+        if not await leader_lease.acquire():
+            return 0
+        before = utcnow() - dt.timedelta(days=self.retention_days)
+        archived = 0
+        async with ArchiveRepository() as repository:
+            for _ in range(self.max_batches):
+                moved = await repository.archive(before, self.batch_size)
+                archived += moved
+                if moved < self.batch_size:
+                    break
+        if archived:
+            logger.info(f"Archived {archived} tasks created before {before}")
+        return archived
+
+
+task_archiver = TaskArchiver()
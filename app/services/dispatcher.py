@@ -0,0 +1,104 @@
+import asyncio
+import datetime as dt
+import json
+import os
+import random
+
+from loguru import logger
+
+from app.db.tables import TaskDispatch
+from app.repositories.resilience import CircuitOpenError
+from app.services.schedule import utcnow
+from app.services.task import TaskService
+
+
+class TaskDispatcher:
+    """Submits dispatched tasks to upstream from the durable task_dispatches outbox.
+
+    Every worker runs a dispatcher; rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED,
+    so the work is shared between them. Failed starts are retried with exponential backoff
+    and dead-lettered after `max_attempts`. When more dispatches are due than a batch takes,
+    app bundles are served in weighted round-robin. Starts hitting an open circuit are postponed
+    until it half-opens without spending an attempt.
+    """
+    concurrency = int(os.getenv("DISPATCHER_CONCURRENCY", 16))
+    interval = float(os.getenv("DISPATCHER_INTERVAL", 5))
+    lease_timeout = float(os.getenv("DISPATCHER_LEASE_TIMEOUT", 300))
+    max_attempts = int(os.getenv("DISPATCHER_MAX_ATTEMPTS", 5))
+    retry_base_delay = float(os.getenv("DISPATCHER_RETRY_BASE_DELAY", 5))
+    # {"app.bundle": 3, ...}, bundles which are not listed have weight 1
+    bundle_weights: dict[str, float] = {
+        bundle: float(weight) for bundle, weight in json.loads(os.getenv("BUNDLE_WEIGHTS", "{}")).items()
+    }
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def wake(self):
+        """Dispatch right away instead of waiting for the next interval"""
+        self._wakeup.set()
+
+    def _retry_at(self, attempts: int) -> dt.datetime:
+        delay = self.retry_base_delay * 2 ** (attempts - 1)
+        return utcnow() + dt.timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+    async def _dispatch(self, dispatch: TaskDispatch):
+        async with TaskService() as service:
+            try:
+                await service.start(dispatch)
+            except CircuitOpenError as e:
+                logger.warning(f"Dispatch {dispatch.id} postponed: {e}")
+                await service.postpone(dispatch, str(e), utcnow() + dt.timedelta(seconds=e.retry_in))
+            except FileNotFoundError as e:
+                # The spooled upload is gone, retries can't bring it back
+                logger.error(f"Dispatch {dispatch.id} dead-lettered: {e}")
+                await service.fail(dispatch, f"{type(e).__name__}: {e}")
+            except Exception as e:
+                logger.exception(e)
+                error = f"{type(e).__name__}: {e}"
+                if dispatch.attempts >= self.max_attempts:
+                    await service.fail(dispatch, error)
+                else:
+                    await service.retry(dispatch, error, self._retry_at(dispatch.attempts))
+
+    async def dispatch_batch(self) -> int:
+        now = utcnow()
+        async with TaskService() as service:
+            dispatches = await service.dispatch_repository.claim(
+                self.concurrency, now, now + dt.timedelta(seconds=self.lease_timeout), self.bundle_weights
+            )
+        await asyncio.gather(*[self._dispatch(dispatch) for dispatch in dispatches])
+        return len(dispatches)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await self.dispatch_batch()
+            except Exception as e:
+                logger.exception(e)
+                claimed = 0
+            if claimed >= self.concurrency:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except TimeoutError:
+                pass
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+task_dispatcher = TaskDispatcher()
@@ -0,0 +1,63 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from uuid import uuid4
+
+from PIL import Image
+
+from app.schemas.models import ImageFormat
+
+media_types = {
+    ImageFormat.png: "image/png",
+    ImageFormat.jpeg: "image/jpeg",
+    ImageFormat.webp: "image/webp",
+}
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def sniff_media_type(path: Path) -> str:
+    """Content type of an original blob by its magic bytes"""
+    with open(path, "rb") as file:
+        header = file.read(12)
+    if header.startswith(b"\xff\xd8\xff"):
+        return media_types[ImageFormat.jpeg]
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return media_types[ImageFormat.webp]
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return media_types[ImageFormat.png]
+
+
+def render_variant(source: str, target: str, width: int | None, image_format: str):
+    """Runs in the process pool: resize to width keeping the aspect ratio and re-encode"""
+    with Image.open(source) as image:
+        if width is not None and image.width > width:
+            image.thumbnail((width, round(image.height * width / image.width)))
+        if image_format == ImageFormat.jpeg.value and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp_target = f"{target}.{uuid4().hex}.tmp"
+        image.save(tmp_target, format=image_format.upper(), quality=85)
+    os.replace(tmp_target, target)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_VARIANT_WORKERS", 2)))
+    return _pool
+
+
+async def make_variant(source: Path, target: Path, width: int | None, image_format: ImageFormat):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    await asyncio.get_running_loop().run_in_executor(
+        _get_pool(), render_variant, str(source), str(target), width, image_format.value
+    )
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
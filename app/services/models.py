@@ -1,24 +1,80 @@
+import hashlib
+from pathlib import Path
 from uuid import UUID
-from fastapi import Depends
+from fastapi import Depends, HTTPException
+from pydantic import TypeAdapter
 
+from app.repositories.blob_store import BlobStoreRepository
 from app.repositories.prompt import PromptRepository
-from app.schemas.models import ModelSearchSchema, ModelSchema
+from app.schemas.models import ImageFormat, ModelListPageSchema, ModelSearchSchema, ModelSchema
+from app.services import image_variants
+
+
+models_adapter = TypeAdapter(list[ModelSchema])
 
 
 class ModelsService:
     def __init__(
             self,
-            prompt_repository: PromptRepository = Depends()
+            prompt_repository: PromptRepository = Depends(),
+            blob_store_repository: BlobStoreRepository = Depends()
     ):
         self.prompt_repository = prompt_repository
+        self.blob_store_repository = blob_store_repository
+
+    async def list(self, schema: ModelSearchSchema) -> ModelListPageSchema:
+        """Serialized catalog page, cached per catalog version and page"""
+        version = await self.prompt_repository.get_catalog_version()
+        key = ("catalog", version, schema.after, schema.page, schema.count)
+        page = self.prompt_repository.catalog_cache.get(key)
+        if page is not None:
+            return page
+
+        models = await self.prompt_repository.list_models(schema.count, schema.after, schema.page)
+        body = models_adapter.dump_json(models)
+        page = ModelListPageSchema(
+            body=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()}"',
+            next_cursor=(models[-1].id if len(models) == schema.count else None),
+            version=version
+        )
+        self.prompt_repository.catalog_cache.set(key, page)
+        return page
 
-    async def list(self, schema: ModelSearchSchema) -> list[ModelSchema]:
-        prompts = await self.prompt_repository.list(is_model=True, **schema.model_dump())
-        return [
-            ModelSchema.model_validate(prompt)
-            for prompt in prompts
-        ]
+    async def get_image_hash(self, model_id: UUID) -> str:
+        image_hash = await self.prompt_repository.get_image_hash(model_id)
+        if image_hash is None:
+            raise HTTPException(404)
+        return image_hash
+
+    async def _get_original(self, image_hash: str, model_id: UUID) -> tuple[str, Path]:
+        """Return the content hash and file of the image from the blob store, loading it from the database on a miss.
+        A loaded image is stored under the hash of its bytes, which differs from `image_hash` if that one is stale
+        """
+        path = self.blob_store_repository.get(image_hash)
+        if path is not None:
+            return image_hash, path
+        image = await self.prompt_repository.get_image(model_id)
+        if image is None:
+            raise HTTPException(404)
+        return await self.blob_store_repository.put(image)
+
+    async def get_image(
+            self,
+            image_hash: str,
+            model_id: UUID,
+            width: int | None = None,
+            image_format: ImageFormat | None = None
+    ) -> tuple[Path, str, str]:
+        """Return the image file, its media type and the content hash of the original.
+        Resized or re-encoded variants are rendered once in a process pool and kept next to the original
+        """
+        image_hash, original = await self._get_original(image_hash, model_id)
+        if image_format is None:
+            return original, image_variants.sniff_media_type(original), image_hash
 
-    async def get_image(self, model_id: UUID) -> bytes:
-        return await self.prompt_repository.get_image(model_id)
+        path = self.blob_store_repository.variant_path(image_hash, width, image_format.value)
+        if not path.is_file():
+            await image_variants.make_variant(original, path, width, image_format)
+        return path, image_variants.media_types[image_format], image_hash
 
@@ -0,0 +1,45 @@
+import asyncio
+from collections import defaultdict
+from uuid import UUID
+
+from app.schemas.task import TaskSchema
+
+
+class TaskStatusHub:
+    """In-process fan-out of task status changes to waiting clients.
+    Fed by the postgres listener, so changes made by any worker reach it
+    """
+
+    def __init__(self):
+        self._subscribers: dict[UUID, set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, task_id: UUID) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers[task_id].add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: UUID, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[task_id]
+
+    def publish(self, schema: TaskSchema):
+        for queue in self._subscribers.get(schema.id, ()):
+            queue.put_nowait(schema)
+
+    def publish_json(self, payload: str):
+        """Callback for the postgres task status channel"""
+        self.publish(TaskSchema.model_validate_json(payload))
+
+    @staticmethod
+    async def next(queue: asyncio.Queue, timeout: float) -> TaskSchema | None:
+        try:
+            return await asyncio.wait_for(queue.get(), timeout)
+        except TimeoutError:
+            return None
+
+
+task_status_hub = TaskStatusHub()
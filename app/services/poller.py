@@ -0,0 +1,103 @@
+import asyncio
+import datetime as dt
+import os
+import time
+from uuid import UUID
+
+from loguru import logger
+
+from app.db.tables import Task, TaskType
+from app.repositories.external import ExternalRepository
+from app.repositories.lease import leader_lease
+from app.repositories.resilience import CircuitOpenError
+from app.schemas.poller import PollerMetricsSchema
+from app.schemas.task import TaskItemStatusUpdateSchema
+from app.services.task import TaskService
+
+
+class TaskPoller:
+    """Polls upstream statuses of queued tasks.
+
+    The queued set is processed in chunks, higher priority first, of `chunk_size` tasks, each chunk with its own session
+    and a single bulk write of the polled statuses.
+    Upstream calls are capped both globally (`max_in_flight`) and per upstream,
+    and a tick started while the previous one is still running is skipped.
+    Only the holder of the leader lease polls, so running several workers or replicas
+    doesn't multiply upstream traffic. Tasks of an upstream with an open circuit are left
+    due and polled once it recovers.
+    """
+    max_in_flight = int(os.getenv("POLLER_MAX_IN_FLIGHT", 64))
+    image_concurrency = int(os.getenv("POLLER_IMAGE_CONCURRENCY", 32))
+    video_concurrency = int(os.getenv("POLLER_VIDEO_CONCURRENCY", 32))
+    chunk_size = int(os.getenv("POLLER_CHUNK_SIZE", 500))
+    interval = float(os.getenv("POLLER_INTERVAL", 2))
+
+    def __init__(self):
+        self.metrics = PollerMetricsSchema()
+        self._tick_lock = asyncio.Lock()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._upstream_limits = {
+            TaskType.image: asyncio.Semaphore(self.image_concurrency),
+            TaskType.video: asyncio.Semaphore(self.video_concurrency),
+        }
+
+    async def _poll(self, service: TaskService, task: Task) -> TaskItemStatusUpdateSchema | None:
+        if ExternalRepository.breakers[task.type.value].is_open:
+            self.metrics.polls_skipped += 1
+            return None
+        async with self._upstream_limits[task.type], self._in_flight:
+            self.metrics.in_flight += 1
+            try:
+                return await service.check_status(task)
+            except CircuitOpenError:
+                self.metrics.polls_skipped += 1
+                return None
+            except Exception as e:
+                self.metrics.errors_total += 1
+                logger.exception(e)
+                return service.reschedule(task) if task.items else None
+            finally:
+                self.metrics.in_flight -= 1
+
+    async def _process_chunk(self, after: tuple[int, UUID] | None = None) -> list[Task]:
+        """Upstream calls of the chunk run concurrently without holding a connection,
+        their results are written in one transaction
+        """
+        async with TaskService() as service:
+            tasks = await service.task_repository.list_queued(count=self.chunk_size, after=after)
+            await service.release_connection()
+            updates = await asyncio.gather(*[self._poll(service, task) for task in tasks])
+            await service.task_item_repository.bulk_update([update for update in updates if update is not None])
+        return tasks
+
+    async def tick(self):
+        self.metrics.is_leader = await leader_lease.acquire()
+        if not self.metrics.is_leader:
+            return
+        if self._tick_lock.locked():
+            self.metrics.ticks_skipped += 1
+            logger.warning("Previous poller tick is still running, skip")
+            return
+
+        async with self._tick_lock:
+            started = time.monotonic()
+            self.metrics.last_tick_started_at = dt.datetime.now(dt.UTC)
+            backlog_size = 0
+            after = None
+            while True:
+                tasks = await self._process_chunk(after)
+                backlog_size += len(tasks)
+                if len(tasks) < self.chunk_size:
+                    break
+                after = (tasks[-1].priority, tasks[-1].id)
+
+            self.metrics.backlog_size = backlog_size
+            self.metrics.open_circuits = [
+                upstream for upstream, breaker in ExternalRepository.breakers.items() if breaker.is_open
+            ]
+            self.metrics.last_tick_duration = time.monotonic() - started
+            self.metrics.ticks_total += 1
+            logger.debug(f"Poller tick: {self.metrics.model_dump()}")
+
+
+task_poller = TaskPoller()
@@ -0,0 +1,61 @@
+import datetime as dt
+import os
+import random
+
+from app.db.tables import TaskType
+from app.repositories.external import ExternalRepository
+
+
+def utcnow() -> dt.datetime:
+    """Naive UTC now, the same as the database `now() at time zone 'utc'` defaults"""
+    return dt.datetime.now(dt.UTC).replace(tzinfo=None)
+
+
+class PollSchedule:
+    """Computes when a queued task item should be polled next.
+
+    The delay grows exponentially with the number of polls already done,
+    is never shorter than a fraction of the task age and respects the upstream Retry-After hint.
+    When upstream callbacks are enabled, polling is only a fallback sweeper,
+    so all delays are stretched by `fallback_factor`.
+    """
+    base_delays = {
+        TaskType.image: float(os.getenv("POLL_IMAGE_BASE_DELAY", 2)),
+        TaskType.video: float(os.getenv("POLL_VIDEO_BASE_DELAY", 20)),
+    }
+    max_delays = {
+        TaskType.image: float(os.getenv("POLL_IMAGE_MAX_DELAY", 30)),
+        TaskType.video: float(os.getenv("POLL_VIDEO_MAX_DELAY", 120)),
+    }
+    age_factor = float(os.getenv("POLL_AGE_FACTOR", 0.1))
+    max_hint_delay = float(os.getenv("POLL_MAX_HINT_DELAY", 600))
+    jitter = float(os.getenv("POLL_JITTER", 0.2))
+    fallback_factor = float(os.getenv("POLL_FALLBACK_FACTOR", 10))
+
+    @classmethod
+    def delay(
+            cls,
+            task_type: TaskType,
+            age: dt.timedelta,
+            attempts: int,
+            hint: float | None = None
+    ) -> float:
+        factor = cls.fallback_factor if ExternalRepository.callbacks_enabled() else 1
+        delay = cls.base_delays[task_type] * factor * 2 ** min(attempts, 16)
+        delay = max(delay, age.total_seconds() * cls.age_factor)
+        delay = min(delay, cls.max_delays[task_type] * factor)
+        if hint is not None:
+            delay = min(max(delay, hint), cls.max_hint_delay)
+        return delay * random.uniform(1 - cls.jitter, 1 + cls.jitter)
+
+    @classmethod
+    def next_poll_at(
+            cls,
+            task_type: TaskType,
+            created_at: dt.datetime,
+            attempts: int,
+            hint: float | None = None
+    ) -> dt.datetime:
+        now = utcnow()
+        delay = cls.delay(task_type, now - created_at, attempts, hint)
+        return now + dt.timedelta(seconds=delay)
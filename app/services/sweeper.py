@@ -0,0 +1,32 @@
+import os
+
+from loguru import logger
+
+from app.repositories.idempotency_key import IdempotencyKeyRepository
+from app.repositories.lease import leader_lease
+from app.services.schedule import utcnow
+
+
+class IdempotencyKeySweeper:
+    """Deletes expired idempotency keys in batches of `batch_size`. Only the leader sweeps"""
+    batch_size = int(os.getenv("IDEMPOTENCY_SWEEP_BATCH_SIZE", 1000))
+    max_batches = int(os.getenv("IDEMPOTENCY_SWEEP_MAX_BATCHES", 20))
+    interval = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", 300))
+
+    async def run(self) -> int:
+        if not await leader_lease.acquire():
+            return 0
+        now = utcnow()
+        deleted = 0
+        async with IdempotencyKeyRepository() as repository:
+            for _ in range(self.max_batches):
+                count = await repository.delete_expired(now, self.batch_size)
+                deleted += count
+                if count < self.batch_size:
+                    break
+        if deleted:
+            logger.info(f"Swept {deleted} expired idempotency keys")
+        return deleted
+
+
+idempotency_key_sweeper = IdempotencyKeySweeper()
@@ -1,140 +1,451 @@
-import io
-from typing import BinaryIO
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator
 from uuid import UUID
 from fastapi import Depends, HTTPException, UploadFile
-from sqlalchemy_service.base_db.base import asyncio
 from loguru import logger
 
 from app.repositories.external import ExternalRepository
+from app.repositories.idempotency_key import IdempotencyKeyRepository
 from app.repositories.prompt import PromptRepository
+from app.repositories.quota import QuotaRepository
+from app.repositories.spool import SpoolRepository
 from app.repositories.task import TaskRepository
+from app.repositories.task_dispatch import TaskDispatchRepository
 from app.repositories.task_image import TaskImageRepository
 from app.repositories.task_item import TaskItemRepository
-from app.schemas.external import ExternalVideoGeneration
-from app.schemas.task import TaskImageCreateSchema, TaskSchema, TaskVideoCreateSchema
-from app.db.tables import Task, TaskImage, TaskItem, TaskStatus, TaskType
+from app.schemas.api_token import ApiTokenSchema
+from app.schemas.external import ExternalImageGeneration, ExternalVideoGeneration
+from app.schemas.task import TaskImageCreateSchema, TaskItemStatusUpdateSchema, TaskSchema, TaskVideoCreateSchema
+from app.services.notifier import task_status_hub
+from app.services.schedule import PollSchedule, utcnow
+from app.db.tables import DispatchKind, Task, TaskDispatch, TaskImage, TaskItem, TaskStatus, TaskType
 
 
 class TaskService:
+    stream_keepalive = float(os.getenv("TASK_STREAM_KEEPALIVE", 15))
+    stream_max_duration = float(os.getenv("TASK_STREAM_MAX_DURATION", 600))
+    image_reuse_ttl = float(os.getenv("VIDEO_IMAGE_REUSE_TTL", 24 * 60 * 60))
+    # {"app.bundle": 10, ...}, default priority of the bundle tasks, unlisted bundles have 0
+    bundle_priorities: dict[str, int] = {
+        bundle: int(priority) for bundle, priority in json.loads(os.getenv("BUNDLE_PRIORITIES", "{}")).items()
+    }
+
     def __init__(
             self,
             task_repository: TaskRepository = Depends(),
             task_item_repository: TaskItemRepository = Depends(),
             image_repository: TaskImageRepository = Depends(),
             external_repository: ExternalRepository = Depends(),
-            prompt_repository: PromptRepository = Depends()
+            prompt_repository: PromptRepository = Depends(),
+            dispatch_repository: TaskDispatchRepository = Depends(),
+            spool_repository: SpoolRepository = Depends(),
+            idempotency_repository: IdempotencyKeyRepository = Depends(),
+            quota_repository: QuotaRepository = Depends()
     ):
         self.task_repository = task_repository
         self.external_repository = external_repository
         self.prompt_repository = prompt_repository
         self.task_item_repository = task_item_repository
         self.image_repository = image_repository
+        self.dispatch_repository = dispatch_repository
+        self.spool_repository = spool_repository
+        self.idempotency_repository = idempotency_repository
+        self.quota_repository = quota_repository
 
-    async def _save_image(self, image_buffer: BinaryIO, task_id: UUID):
-        external_id = await self.external_repository.upload_image_for_video(image_buffer)
-        model = TaskImage(task_id=task_id, external_id=external_id)
-        await self.image_repository.create(model)
-
-    async def get(self, task_id: UUID) -> TaskSchema:
-        model = await self.task_repository.get(task_id)
+    @staticmethod
+    def _make_status_schema(row) -> TaskSchema:
+        if row.status is None:
+            # Generation is not started yet or its dispatch is dead
+            status = TaskStatus.error if row.error is not None else TaskStatus.queued
+            return TaskSchema(id=row.id, error=row.error, status=status)
         return TaskSchema(
-            id=model.id,
-            error=model.error,
-            status=model.items[0].status,
-            result_url=(model.items[0].result_url if model.items[0].status == TaskStatus.finished else None)
+            id=row.id,
+            error=row.error,
+            status=row.status,
+            result_url=(row.result_url if row.status == TaskStatus.finished else None)
         )
 
-    async def create_video(self, schema: TaskVideoCreateSchema, file: UploadFile) -> TaskSchema:
-        model = Task(app_bundle=schema.app_bundle, user_id=schema.user_id, type=TaskType.video)
-        model = await self.task_repository.create(model)
-        await self._save_image(file.file, model.id)
-        return TaskSchema.model_validate(model)
+    async def get_many(self, task_ids: list[UUID]) -> dict[UUID, TaskSchema]:
+        """Unknown ids are left out of the result"""
+        rows = await self.task_repository.list_statuses(task_ids)
+        return {row.id: self._make_status_schema(row) for row in rows}
+
+    async def get(self, task_id: UUID) -> TaskSchema:
+        rows = await self.task_repository.list_statuses([task_id])
+        if not rows:
+            raise HTTPException(404)
+        return self._make_status_schema(rows[0])
+
+    async def wait(self, task_id: UUID, timeout: float) -> TaskSchema:
+        """Return the task status as soon as it leaves the queue, or the current one after timeout.
+        The connection is released before waiting, the awakened status comes from the notification
+        """
+        queue = task_status_hub.subscribe(task_id)
+        try:
+            schema = await self.get(task_id)
+            await self.release_connection()
+            if schema.status == TaskStatus.queued and timeout > 0:
+                schema = await task_status_hub.next(queue, timeout) or schema
+            return schema
+        finally:
+            task_status_hub.unsubscribe(task_id, queue)
+
+    async def stream(self, task_id: UUID) -> AsyncIterator[str]:
+        """Subscribe before reading the current status, so no change is lost in between.
+        The returned iterator yields Server-Sent Events until the task leaves the queue
+        """
+        queue = task_status_hub.subscribe(task_id)
+        try:
+            schema = await self.get(task_id)
+            await self.release_connection()
+        except Exception:
+            task_status_hub.unsubscribe(task_id, queue)
+            raise
+        return self._stream_events(schema, queue)
+
+    async def _stream_events(self, schema: TaskSchema, queue: asyncio.Queue) -> AsyncIterator[str]:
+        deadline = time.monotonic() + self.stream_max_duration
+        try:
+            yield f"event: status\ndata: {schema.model_dump_json()}\n\n"
+            while schema.status == TaskStatus.queued and time.monotonic() < deadline:
+                update = await task_status_hub.next(queue, self.stream_keepalive)
+                if update is None:
+                    yield ": keepalive\n\n"
+                    continue
+                schema = update
+                yield f"event: status\ndata: {schema.model_dump_json()}\n\n"
+        finally:
+            task_status_hub.unsubscribe(schema.id, queue)
+
+    @staticmethod
+    def _check_bundle(app_bundle: str, api_token: ApiTokenSchema | None):
+        """A token bound to an app bundle can create tasks only for it"""
+        if api_token is not None and api_token.app_bundle is not None and api_token.app_bundle != app_bundle:
+            raise HTTPException(403, detail="Token is not allowed to create tasks for this app_bundle")
+
+    def _priority(self, app_bundle: str, requested: int | None) -> int:
+        return requested if requested is not None else self.bundle_priorities.get(app_bundle, 0)
+
+    @staticmethod
+    def _request_hash(kind: DispatchKind, payload: dict) -> str:
+        """Fingerprint of the request body, uploaded files are not part of it"""
+        return hashlib.sha256(f"{kind.value}:{json.dumps(payload, sort_keys=True)}".encode()).hexdigest()
 
-    async def create_image(self, schema: TaskImageCreateSchema) -> TaskSchema:
-        model = Task(app_bundle=schema.app_bundle, user_id=schema.user_id, type=TaskType.image)
+    async def _replay(self, app_bundle: str, idempotency_key: str | None, request_hash: str) -> TaskSchema | None:
+        """Current state of the task created by the first request with the key"""
+        if idempotency_key is None:
+            return None
+        record = await self.idempotency_repository.get_by_key(app_bundle, idempotency_key)
+        if record is None:
+            return None
+        if record.request_hash != request_hash:
+            raise HTTPException(422, detail="Idempotency-Key is already used by another request")
+        logger.debug(f"Replay of idempotent request {idempotency_key} for task {record.task_id}")
+        return await self.get(record.task_id)
+
+    async def _create(self, model: Task, dispatch: TaskDispatch, idempotency_key: str | None, tier: str) -> TaskSchema:
+        """Task, its dispatch and idempotency key are committed together, so a started task is never lost.
+        The quota is charged only here, after the upload is spooled and the request is known to create a new task
+        """
+        self.dispatch_repository.add(dispatch)
+        if idempotency_key is not None:
+            request_hash = self._request_hash(dispatch.kind, dispatch.payload)
+            self.task_repository.session.add(model)
+            await self.task_repository.session.flush()
+            claimed = await self.idempotency_repository.claim(
+                model.app_bundle, idempotency_key, request_hash, model.id, utcnow()
+            )
+            if not claimed:
+                # A concurrent request with the same key won the race
+                await self.task_repository.session.rollback()
+                self.spool_repository.delete(dispatch.file_path)
+                return await self._replay(model.app_bundle, idempotency_key, request_hash)
+        try:
+            await self.quota_repository.hit(model.app_bundle, model.user_id, tier)
+        except HTTPException:
+            await self.task_repository.session.rollback()
+            self.spool_repository.delete(dispatch.file_path)
+            raise
         model = await self.task_repository.create(model)
         return TaskSchema.model_validate(model)
 
-    async def start_video(self, task_id: UUID, schema: TaskVideoCreateSchema):
+    async def create_video(
+            self,
+            schema: TaskVideoCreateSchema,
+            file: UploadFile,
+            idempotency_key: str | None = None,
+            priority: int | None = None,
+            api_token: ApiTokenSchema | None = None
+    ) -> TaskSchema:
+        self._check_bundle(schema.app_bundle, api_token)
+        payload = schema.model_dump(mode="json")
+        request_hash = self._request_hash(DispatchKind.video, payload)
+        replay = await self._replay(schema.app_bundle, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+        model = Task(
+            app_bundle=schema.app_bundle,
+            user_id=schema.user_id,
+            type=TaskType.video,
+            priority=self._priority(schema.app_bundle, priority)
+        )
+        file_path, file_hash = await self.spool_repository.save_upload(file)
+        dispatch = TaskDispatch(
+            task=model,
+            kind=DispatchKind.video,
+            payload=payload,
+            file_path=file_path,
+            file_hash=file_hash
+        )
+        tier = api_token.tier if api_token is not None else "default"
+        return await self._create(model, dispatch, idempotency_key, tier)
+
+    async def create_image(
+            self,
+            schema: TaskImageCreateSchema,
+            idempotency_key: str | None = None,
+            priority: int | None = None,
+            api_token: ApiTokenSchema | None = None
+    ) -> TaskSchema:
+        self._check_bundle(schema.app_bundle, api_token)
+        payload = schema.model_dump(mode="json")
+        request_hash = self._request_hash(DispatchKind.image, payload)
+        replay = await self._replay(schema.app_bundle, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+        model = Task(
+            app_bundle=schema.app_bundle,
+            user_id=schema.user_id,
+            type=TaskType.image,
+            priority=self._priority(schema.app_bundle, priority)
+        )
+        dispatch = TaskDispatch(task=model, kind=DispatchKind.image, payload=payload)
+        tier = api_token.tier if api_token is not None else "default"
+        return await self._create(model, dispatch, idempotency_key, tier)
+
+    async def create_image_to_image(
+            self,
+            schema: TaskImageCreateSchema,
+            file: UploadFile,
+            idempotency_key: str | None = None,
+            priority: int | None = None,
+            api_token: ApiTokenSchema | None = None
+    ) -> TaskSchema:
+        self._check_bundle(schema.app_bundle, api_token)
+        payload = schema.model_dump(mode="json")
+        request_hash = self._request_hash(DispatchKind.image_to_image, payload)
+        replay = await self._replay(schema.app_bundle, idempotency_key, request_hash)
+        if replay is not None:
+            return replay
+        model = Task(
+            app_bundle=schema.app_bundle,
+            user_id=schema.user_id,
+            type=TaskType.image,
+            priority=self._priority(schema.app_bundle, priority)
+        )
+        file_path, file_hash = await self.spool_repository.save_upload(file)
+        dispatch = TaskDispatch(
+            task=model,
+            kind=DispatchKind.image_to_image,
+            payload=payload,
+            file_path=file_path,
+            file_hash=file_hash
+        )
+        tier = api_token.tier if api_token is not None else "default"
+        return await self._create(model, dispatch, idempotency_key, tier)
+
+    async def start(self, dispatch: TaskDispatch):
+        """Submit the dispatched task to upstream.
+        No connection is held during upstream calls: the transaction ends after the reads,
+        the dispatch row is removed in the same commit which creates the task item
+        """
+        if dispatch.kind == DispatchKind.video:
+            await self._save_image(dispatch.task_id, dispatch.file_path, dispatch.file_hash)
+            item = await self.start_video(dispatch.task_id, TaskVideoCreateSchema.model_validate(dispatch.payload))
+        elif dispatch.kind == DispatchKind.image_to_image:
+            schema = TaskImageCreateSchema.model_validate(dispatch.payload)
+            item = await self.start_image_to_image(dispatch.task_id, dispatch.file_path, schema)
+        else:
+            item = await self.start_image(dispatch.task_id, TaskImageCreateSchema.model_validate(dispatch.payload))
+
+        await self.dispatch_repository.stage_delete(dispatch.id)
+        await self.task_repository.create_items(item)
+        self.spool_repository.delete(dispatch.file_path)
+
+    async def release_connection(self):
+        """End the read transaction, so its connection goes back to the pool before a slow upstream call.
+        Loaded objects stay usable: the session doesn't expire them on commit
+        """
+        await self.task_repository.session.commit()
+
+    async def retry(self, dispatch: TaskDispatch, error: str, next_attempt_at: dt.datetime):
+        await self.task_repository.session.rollback()
+        await self.dispatch_repository.retry(dispatch.id, error, next_attempt_at)
+
+    async def postpone(self, dispatch: TaskDispatch, error: str, next_attempt_at: dt.datetime):
+        await self.task_repository.session.rollback()
+        await self.dispatch_repository.postpone(dispatch.id, error, next_attempt_at)
+
+    async def fail(self, dispatch: TaskDispatch, error: str):
+        """Dead-letter the dispatch and report the task as failed"""
+        await self.task_repository.session.rollback()
+        await self.dispatch_repository.mark_dead(dispatch.id, error)
+        await self.task_item_repository.notify_status(
+            TaskSchema(id=dispatch.task_id, error=error, status=TaskStatus.error)
+        )
+        await self.task_repository.update(dispatch.task_id, error=error)
+        self.spool_repository.delete(dispatch.file_path)
+
+    async def _save_image(self, task_id: UUID, image_path: str | None, content_hash: str | None):
+        """Upload the source image for video once, retried starts reuse it.
+        An image with the same content uploaded recently is reused instead of uploading it again
+        """
+        task = await self.task_repository.get(task_id)
+        if task.images or image_path is None:
+            return
+        external_id = None
+        if content_hash is not None:
+            since = utcnow() - dt.timedelta(seconds=self.image_reuse_ttl)
+            external_id = await self.image_repository.find_external_id(content_hash, since)
+        await self.release_connection()
+        if external_id is None:
+            with open(image_path, "rb") as image:
+                external_id = await self.external_repository.upload_image_for_video(image)
+        else:
+            logger.debug(f"Reuse uploaded image {external_id} for task {task_id}")
+        await self.image_repository.create(TaskImage(task=task, external_id=external_id, content_hash=content_hash))
+
+    async def start_video(self, task_id: UUID, schema: TaskVideoCreateSchema) -> TaskItem:
         task = await self.task_repository.get(task_id)
         if not task.images:
             raise ValueError("Task hasn't image")
 
         if schema.model_id is not None:
-            prompt = await self.prompt_repository.get(schema.model_id)
+            prompt = await self.prompt_repository.get_cached(schema.model_id)
         else:
             prompt = await self.prompt_repository.get_video_basic()
 
+        await self.release_connection()
         external_id = await self.external_repository.start_video_generate(prompt.text, task.images[0].external_id)
-        await self.task_repository.create_items(
-            TaskItem(task_id=task_id, external_id=external_id, result_url=self.external_repository.make_video_url(external_id))
+        return TaskItem(
+            task_id=task_id,
+            external_id=external_id,
+            result_url=self.external_repository.make_video_url(external_id),
+            next_poll_at=PollSchedule.next_poll_at(task.type, task.created_at, 0)
         )
 
-    async def start_image_to_image(self, task_id: UUID, image_body: bytes, schema: TaskImageCreateSchema):
+    async def start_image_to_image(self, task_id: UUID, image_path: str, schema: TaskImageCreateSchema) -> TaskItem:
         task = await self.task_repository.get(task_id)
 
         if schema.model_id is not None:
-            prompt_model = await self.prompt_repository.get(schema.model_id)
+            prompt_model = await self.prompt_repository.get_cached(schema.model_id)
         else:
             prompt_model = await self.prompt_repository.get_image_basic()
         prompt_text = prompt_model.text + schema.prompt
-        image = io.BytesIO(image_body)
-        image.name = "a.jpg"
 
-        external_id = await self.external_repository.start_image2image_generate(prompt_text, image, schema.aspect_ratio.value)
-        await self.task_repository.create_items(
-            TaskItem(task_id=task_id, external_id=external_id, result_url=None)
+        await self.release_connection()
+        with open(image_path, "rb") as image:
+            external_id = await self.external_repository.start_image2image_generate(prompt_text, image, schema.aspect_ratio.value)
+        return TaskItem(
+            task_id=task_id,
+            external_id=external_id,
+            result_url=None,
+            next_poll_at=PollSchedule.next_poll_at(task.type, task.created_at, 0)
         )
 
-    async def start_image(self, task_id: UUID, schema: TaskImageCreateSchema):
+    async def start_image(self, task_id: UUID, schema: TaskImageCreateSchema) -> TaskItem:
         task = await self.task_repository.get(task_id)
 
         if schema.model_id is not None:
-            prompt_model = await self.prompt_repository.get(schema.model_id)
+            prompt_model = await self.prompt_repository.get_cached(schema.model_id)
         else:
             prompt_model = await self.prompt_repository.get_image_basic()
         prompt_text = prompt_model.text + schema.prompt
 
+        await self.release_connection()
         external_id = await self.external_repository.start_image_generate(prompt_text, schema.aspect_ratio.value)
-        await self.task_repository.create_items(
-            TaskItem(task_id=task_id, external_id=external_id, result_url=None)
+        return TaskItem(
+            task_id=task_id,
+            external_id=external_id,
+            result_url=None,
+            next_poll_at=PollSchedule.next_poll_at(task.type, task.created_at, 0)
         )
 
-    async def _get_video_status(self, external_id: str) -> TaskStatus:
-        response = await self.external_repository.get_video_generation(external_id)
+    def reschedule(self, task: Task, hint: float | None = None) -> TaskItemStatusUpdateSchema:
+        """Keep the item queued and back off its next poll"""
+        item = task.items[0]
+        return TaskItemStatusUpdateSchema(
+            item_id=item.id,
+            task_id=task.id,
+            status=TaskStatus.queued,
+            result_url=item.result_url,
+            next_poll_at=PollSchedule.next_poll_at(task.type, task.created_at, item.poll_attempts, hint),
+            poll_attempts=item.poll_attempts + 1
+        )
+
+    def _finish(self, task: Task, status: TaskStatus, result_url: str | None) -> TaskItemStatusUpdateSchema:
+        item = task.items[0]
+        return TaskItemStatusUpdateSchema(
+            item_id=item.id,
+            task_id=task.id,
+            status=status,
+            result_url=result_url,
+            poll_attempts=item.poll_attempts + 1
+        )
+
+    async def _check_video_status(self, task: Task) -> TaskItemStatusUpdateSchema:
+        item = task.items[0]
+        response = await self.external_repository.get_video_generation(str(item.external_id))
         if response.is_finished:
-            return TaskStatus.finished
+            return self._finish(task, TaskStatus.finished, item.result_url)
         if response.is_invalid:
-            return TaskStatus.error
-        return TaskStatus.queued
+            return self._finish(task, TaskStatus.error, item.result_url)
+        return self.reschedule(task, response.retry_after)
 
-    async def _update_video_status(self, task: Task):
-        if not task.items:
-            raise ValueError("Task hasn't items")
-        status = await self._get_video_status(str(task.items[0].external_id))
-        if status == TaskStatus.queued:
-            return
-        await self.task_item_repository.update(task.items[0].id, status=status)
+    async def _check_image_status(self, task: Task) -> TaskItemStatusUpdateSchema:
+        item = task.items[0]
+        response = await self.external_repository.get_image_generation(str(item.external_id))
+        if response.is_invalid:
+            return self._finish(task, TaskStatus.error, item.result_url)
+        if response.is_finished:
+            return self._finish(task, TaskStatus.finished, response.image_url)
+        return self.reschedule(task, response.retry_after)
 
-    async def _update_image_status(self, task: Task):
+    async def check_status(self, task: Task) -> TaskItemStatusUpdateSchema:
+        """Ask upstream for the status of the task item. Doesn't touch the database"""
         if not task.items:
             raise ValueError("Task hasn't items")
-        response = await self.external_repository.get_image_generation(str(task.items[0].external_id))
-        if not response.is_finished and not response.is_invalid:
-            return
-        elif response.is_invalid:
-            await self.task_item_repository.update(task.items[0].id, status=TaskStatus.error)
-        else:
-            await self.task_item_repository.update(task.items[0].id, status=TaskStatus.finished, result_url=response.image_url)
+        if task.type == TaskType.video:
+            return await self._check_video_status(task)
+        return await self._check_image_status(task)
+
+    async def _apply_callback(self, external_id: str, status: TaskStatus, **fields):
+        try:
+            external_id = UUID(external_id)
+        except ValueError:
+            raise HTTPException(404)
+        if not await self.task_item_repository.settle_queued(external_id, status, **fields):
+            # An item settled meanwhile is left as is, an unknown one is 404
+            await self.task_item_repository.get_by_external_id(external_id)
+
+    async def handle_image_callback(self, schema: ExternalImageGeneration):
+        logger.debug(f"Image API callback: {schema.model_dump()}")
+        if schema.is_invalid:
+            await self._apply_callback(schema.id, TaskStatus.error)
+        elif schema.is_finished:
+            await self._apply_callback(schema.id, TaskStatus.finished, result_url=schema.image_url)
 
-    @classmethod
-    async def update_tasks(cls):
-        async with cls() as self:
-            tasks = await self.task_repository.list_queued()
-            await asyncio.gather(*[
-                (self._update_video_status(task) if task.type == TaskType.video else self._update_image_status(task))
-                for task in tasks
-            ])
+    async def handle_video_callback(self, schema: ExternalVideoGeneration):
+        logger.debug(f"Video API callback: {schema.model_dump()}")
+        if schema.is_finished:
+            await self._apply_callback(schema.id, TaskStatus.finished)
+        elif schema.is_invalid:
+            await self._apply_callback(schema.id, TaskStatus.error)
 
     async def __aenter__(self):
         self.task_repository = TaskRepository()
@@ -143,6 +454,10 @@ class TaskService:
         self.external_repository = ExternalRepository()
         self.prompt_repository = PromptRepository(session=self.task_repository.session)
         self.task_item_repository = TaskItemRepository(session=self.task_repository.session)
+        self.dispatch_repository = TaskDispatchRepository(session=self.task_repository.session)
+        self.spool_repository = SpoolRepository()
+        self.idempotency_repository = IdempotencyKeyRepository(session=self.task_repository.session)
+        self.quota_repository = QuotaRepository()
         return self
 
     async def __aexit__(self, *exc_info):
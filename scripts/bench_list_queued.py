@@ -0,0 +1,65 @@
+"""Benchmark of the poller query while task_items grows.
+
+Seeds QUEUED queued tasks once, then grows only the finished history, one item
+per task, and times TaskRepository.list_queued at every size. With the partial
+ix_task_items_queued index the timing should stay flat.
+
+Run against a scratch database only, it inserts millions of rows:
+
+    postgres_host=... postgres_db=bench python scripts/bench_list_queued.py
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy_service.base_db.base import engine
+
+from app.repositories.task import TaskRepository
+
+SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+QUEUED = 5_000
+CHUNK = 500
+RUNS = 20
+
+seed_query = text("""
+    WITH new_tasks AS (
+        INSERT INTO tasks (type, user_id, app_bundle)
+        SELECT 'image', 'user' || n % 1000, 'bundle' || n % 10 FROM generate_series(1, :count) AS n
+        RETURNING id
+    )
+    INSERT INTO task_items (task_id, external_id, status)
+    SELECT id, gen_random_uuid(), CASE WHEN row_number() OVER () <= :queued THEN 'queued' ELSE 'finished' END::taskstatus
+    FROM new_tasks
+""")
+
+
+async def seed(count: int, queued: int):
+    async with engine.begin() as connection:
+        await connection.execute(seed_query, {"count": count, "queued": queued})
+        await connection.execute(text("ANALYZE tasks, task_items"))
+
+
+async def measure() -> float:
+    timings = []
+    async with TaskRepository() as repository:
+        for _ in range(RUNS):
+            started = time.perf_counter()
+            await repository.list_queued(count=CHUNK)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+async def main():
+    seeded = 0
+    for size in SIZES:
+        # Only the first batch adds queued tasks, later ones grow the finished history
+        await seed(size - seeded, QUEUED if seeded == 0 else 0)
+        seeded = size
+        print(f"task_items={size:>10}  list_queued median={await measure():.2f}ms", flush=True)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,56 @@
+"""Repository tests run against the postgres configured by the usual PG* variables.
+
+All tables are dropped and created again, so point them at a scratch database only
+and enable them with RUN_DB_TESTS=1.
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+async def _recreate_schema():
+    from sqlalchemy_service.base_db.base import Base, engine
+
+    import app.db.tables  # noqa: F401, registers the tables
+
+    async with engine.connect() as connection:
+        try:
+            await connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            await connection.commit()
+            has_trgm = True
+        except DBAPIError:
+            has_trgm = False
+    if not has_trgm:
+        # Only the admin search indexes need pg_trgm
+        for table in Base.metadata.tables.values():
+            for index in list(table.indexes):
+                if index.dialect_options["postgresql"]["using"] == "gin":
+                    table.indexes.discard(index)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+@pytest.fixture
+def run_db():
+    """Recreate the schema and return a runner for async test bodies"""
+    if os.getenv("RUN_DB_TESTS") != "1":
+        pytest.skip("RUN_DB_TESTS=1 is not set")
+    asyncio.run(_recreate_schema())
+
+    def run(coro):
+        from sqlalchemy_service.base_db.base import engine
+
+        async def scenario():
+            try:
+                return await coro
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(scenario())
+
+    return run
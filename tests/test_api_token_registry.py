@@ -0,0 +1,29 @@
+from app.db.tables import ApiToken
+from app.repositories.api_token import ApiTokenRepository
+from app.services.api_token import ApiTokenRegistry
+
+
+async def _add_token(token: str):
+    async with ApiTokenRepository() as repository:
+        repository.session.add(ApiToken(token_hash=ApiTokenRegistry.hash(token)))
+        await repository.session.commit()
+
+
+def test_stale_registry_serves_lookups_while_reloading(run_db):
+    async def scenario():
+        registry = ApiTokenRegistry(tokens=["static"], trusted_tokens=set())
+        registry.refresh_interval = 60
+        await _add_token("first")
+        first_load = await registry.get("first")
+
+        await _add_token("second")
+        registry._loaded_at -= registry.refresh_interval
+        while_stale = await registry.get("second")
+        await registry._reloading
+        after_reload = await registry.get("second")
+        return first_load, while_stale, after_reload
+
+    first_load, while_stale, after_reload = run_db(scenario())
+    assert first_load is not None
+    assert while_stale is None
+    assert after_reload is not None
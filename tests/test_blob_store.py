@@ -0,0 +1,15 @@
+import asyncio
+import hashlib
+
+from app.repositories.blob_store import BlobStoreRepository
+
+
+def test_blob_is_stored_under_the_hash_of_its_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(BlobStoreRepository, "store_dir", tmp_path)
+    store = BlobStoreRepository()
+
+    content_hash, path = asyncio.run(store.put(b"image"))
+
+    assert content_hash == hashlib.sha256(b"image").hexdigest()
+    assert store.get(content_hash) == path
+    assert path.read_bytes() == b"image"
@@ -0,0 +1,34 @@
+from sqlalchemy import select
+
+from app.db.tables import DispatchKind, DispatchStatus, Prompt, Task, TaskDispatch, TaskType
+from app.services.dispatcher import TaskDispatcher
+from app.services.task import TaskService
+
+
+def test_dispatch_with_missing_upload_is_dead_lettered_at_once(run_db):
+    async def scenario():
+        async with TaskService() as service:
+            session = service.task_repository.session
+            task = Task(type=TaskType.image, user_id="user", app_bundle="bundle")
+            dispatch = TaskDispatch(
+                task=task,
+                kind=DispatchKind.image_to_image,
+                payload={"prompt": "cat", "user_id": "user", "app_bundle": "bundle", "aspect_ratio": "square"},
+                file_path="/nonexistent/upload",
+                attempts=1
+            )
+            basic = Prompt(text="", title="basic", is_model=False, for_image=True, for_video=False)
+            session.add_all([task, dispatch, basic])
+            await session.commit()
+
+        await TaskDispatcher()._dispatch(dispatch)
+
+        async with TaskService() as service:
+            session = service.task_repository.session
+            status = await session.scalar(select(TaskDispatch.status).filter_by(id=dispatch.id))
+            error = await session.scalar(select(Task.error).filter_by(id=task.id))
+            return status, error
+
+    status, error = run_db(scenario())
+    assert status == DispatchStatus.dead
+    assert error.startswith("FileNotFoundError")
@@ -0,0 +1,97 @@
+import asyncio
+from typing import Iterator
+
+import pytest
+
+from app.repositories.external import ExternalRepository
+from app.schemas.external import ExternalImageStatus
+
+
+@pytest.fixture
+def repository(monkeypatch) -> Iterator[ExternalRepository]:
+    monkeypatch.setattr(ExternalRepository, "_status_in_flight", {})
+    ExternalRepository.status_cache.clear()
+    yield ExternalRepository()
+    ExternalRepository.status_cache.clear()
+
+
+class Fetch:
+    """Upstream status read which waits until released and counts the calls"""
+
+    def __init__(self, *results: ExternalImageStatus | Exception):
+        self.results = list(results)
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> ExternalImageStatus:
+        self.calls += 1
+        await self.release.wait()
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _status(is_finished: bool = False) -> ExternalImageStatus:
+    return ExternalImageStatus(id="generation", is_finished=is_finished, is_invalid=False)
+
+
+def test_concurrent_reads_share_one_fetch(repository):
+    async def scenario():
+        fetch = Fetch(_status())
+        waiters = [asyncio.create_task(repository._single_flight(("image", "generation"), fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return fetch, await asyncio.gather(*waiters)
+
+    fetch, statuses = asyncio.run(scenario())
+    assert fetch.calls == 1
+    assert all(status == _status() for status in statuses)
+    # Every caller gets its own copy
+    assert len({id(status) for status in statuses}) == 5
+
+
+def test_cancelled_waiter_doesnt_cancel_the_shared_fetch(repository):
+    async def scenario():
+        fetch = Fetch(_status())
+        cancelled = asyncio.create_task(repository._single_flight(("image", "generation"), fetch))
+        waiter = asyncio.create_task(repository._single_flight(("image", "generation"), fetch))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return fetch, cancelled, await waiter
+
+    fetch, cancelled, status = asyncio.run(scenario())
+    assert cancelled.cancelled()
+    assert fetch.calls == 1
+    assert status == _status()
+
+
+def test_errors_are_not_cached(repository):
+    async def scenario():
+        fetch = Fetch(RuntimeError("upstream is down"), _status())
+        fetch.release.set()
+        with pytest.raises(RuntimeError):
+            await repository._single_flight(("image", "generation"), fetch)
+        return fetch, await repository._single_flight(("image", "generation"), fetch)
+
+    fetch, status = asyncio.run(scenario())
+    assert fetch.calls == 2
+    assert status == _status()
+    assert ExternalRepository._status_in_flight == {}
+
+
+def test_terminal_statuses_outlive_the_ttl(repository, monkeypatch):
+    # Statuses still in progress expire at once
+    monkeypatch.setattr(ExternalRepository, "status_cache_ttl", -1)
+
+    async def scenario():
+        fetch = Fetch(_status(), _status(is_finished=True))
+        fetch.release.set()
+        statuses = [await repository._single_flight(("image", "generation"), fetch) for _ in range(4)]
+        return fetch, statuses
+
+    fetch, statuses = asyncio.run(scenario())
+    assert fetch.calls == 2
+    assert [status.is_finished for status in statuses] == [False, True, True, True]
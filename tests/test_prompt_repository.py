@@ -0,0 +1,43 @@
+import uuid
+
+from app.db.tables import Prompt
+from app.repositories.prompt import PromptRepository
+
+
+def test_image_hash_lookups_dont_evict_prompts(run_db):
+    async def scenario():
+        PromptRepository.invalidate_cache()
+        async with PromptRepository() as repository:
+            prompt = Prompt(
+                text="text", title="title", is_model=True, for_image=True, for_video=False, image_hash="hash"
+            )
+            repository.session.add(prompt)
+            await repository.session.commit()
+            await repository.get_cached(prompt.id)
+
+            misses = [await repository.get_image_hash(uuid.uuid4()) for _ in range(PromptRepository.cache.maxsize)]
+            image_hash = await repository.get_image_hash(prompt.id)
+            return prompt.id, misses, image_hash
+
+    prompt_id, misses, image_hash = run_db(scenario())
+    assert misses == [None] * len(misses)
+    assert image_hash == "hash"
+    assert PromptRepository.cache.get(("id", prompt_id)) is not None
+    assert len(PromptRepository.image_hash_cache) == 1
+
+
+def test_catalog_version_is_shared_through_the_database(run_db):
+    async def scenario():
+        PromptRepository.invalidate_cache()
+        async with PromptRepository() as repository:
+            before = await repository.get_catalog_version()
+            await repository.notify_changed(uuid.uuid4())
+            changed = await repository.get_catalog_version()
+            # Another worker, or this one after a restart, starts without a version
+            PromptRepository.catalog_version = None
+            restarted = await repository.get_catalog_version()
+            return before, changed, restarted
+
+    before, changed, restarted = run_db(scenario())
+    assert changed > before
+    assert restarted == changed
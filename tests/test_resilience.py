@@ -0,0 +1,121 @@
+import pytest
+
+from app.repositories import resilience
+from app.repositories.resilience import CircuitBreaker, CircuitOpenError, CircuitState, RetryBudget
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def _open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("image", failure_threshold=3, reset_timeout=30)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_threshold_failures_in_a_row(clock):
+    breaker = CircuitBreaker("image", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.closed
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.open
+
+
+def test_open_breaker_fails_fast(clock):
+    breaker = _open_breaker()
+    clock.now += 10
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_in == pytest.approx(20)
+    assert not error.value.retryable
+
+
+def test_half_open_breaker_lets_a_single_probe_through(clock):
+    breaker = _open_breaker()
+    clock.now += 30
+    assert breaker.state == CircuitState.half_open
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_success_closes_the_breaker(clock):
+    breaker = _open_breaker()
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CircuitState.closed
+    assert breaker.failures == 0
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_probe_failure_opens_the_breaker_again(clock):
+    breaker = _open_breaker()
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.open
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_that_never_reports_back_is_replaced(clock):
+    breaker = _open_breaker()
+    clock.now += 30
+    breaker.before_call()
+
+    clock.now += 30
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_budget_allows_min_retries_without_requests(clock):
+    budget = RetryBudget(ratio=0.5, window=10, min_retries=2)
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+
+
+def test_budget_grows_with_requests(clock):
+    budget = RetryBudget(ratio=0.5, window=10, min_retries=0)
+    for _ in range(4):
+        budget.record_request()
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+
+
+def test_budget_refills_once_the_window_passes(clock):
+    budget = RetryBudget(ratio=0.5, window=10, min_retries=1)
+    for _ in range(2):
+        budget.record_request()
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+
+    clock.now += 5
+    assert not budget.try_spend()
+    clock.now += 6
+    assert budget.try_spend()
+    assert not budget.try_spend()
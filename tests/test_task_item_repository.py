@@ -0,0 +1,90 @@
+import datetime as dt
+import uuid
+
+from sqlalchemy import select
+
+from app.db.tables import Task, TaskItem, TaskStatus, TaskType
+from app.repositories.task_item import TaskItemRepository
+from app.schemas.task import TaskItemStatusUpdateSchema
+
+
+async def _create_task(repository: TaskItemRepository, *statuses: TaskStatus) -> tuple[Task, list[TaskItem]]:
+    task = Task(type=TaskType.image, user_id="user", app_bundle="bundle")
+    items = [TaskItem(task=task, external_id=uuid.uuid4(), status=status) for status in statuses]
+    repository.session.add_all([task, *items])
+    await repository.session.commit()
+    return task, items
+
+
+async def _statuses(repository: TaskItemRepository, items: list[TaskItem]) -> list[tuple]:
+    rows = await repository.session.execute(
+        select(TaskItem.status, TaskItem.result_url, TaskItem.next_poll_at, TaskItem.poll_attempts)
+        .where(TaskItem.id.in_([item.id for item in items]))
+        .order_by(TaskItem.id)
+    )
+    return [tuple(row) for row in rows]
+
+
+def test_bulk_update_chunk_of_only_finished_items(run_db):
+    """Every VALUES row has NULL next_poll_at, postgres must not type the column as text"""
+    async def scenario():
+        async with TaskItemRepository() as repository:
+            task, items = await _create_task(repository, TaskStatus.queued, TaskStatus.queued)
+            await repository.bulk_update([
+                TaskItemStatusUpdateSchema(
+                    item_id=items[0].id, task_id=task.id, status=TaskStatus.finished,
+                    result_url=None, next_poll_at=None, poll_attempts=3
+                ),
+                TaskItemStatusUpdateSchema(
+                    item_id=items[1].id, task_id=task.id, status=TaskStatus.error,
+                    result_url=None, next_poll_at=None, poll_attempts=1
+                ),
+            ])
+            return await _statuses(repository, items)
+
+    assert run_db(scenario()) == [
+        (TaskStatus.finished, None, None, 3),
+        (TaskStatus.error, None, None, 1),
+    ]
+
+
+def test_bulk_update_reschedules_and_skips_items_out_of_queue(run_db):
+    next_poll_at = dt.datetime(2030, 1, 1, 12, 0)
+
+    async def scenario():
+        async with TaskItemRepository() as repository:
+            task, items = await _create_task(repository, TaskStatus.queued, TaskStatus.finished)
+            await repository.bulk_update([
+                TaskItemStatusUpdateSchema(
+                    item_id=items[0].id, task_id=task.id, status=TaskStatus.queued,
+                    next_poll_at=next_poll_at, poll_attempts=1
+                ),
+                TaskItemStatusUpdateSchema(
+                    item_id=items[1].id, task_id=task.id, status=TaskStatus.error,
+                    result_url="http://result", poll_attempts=5
+                ),
+            ])
+            return await _statuses(repository, items)
+
+    assert run_db(scenario()) == [
+        (TaskStatus.queued, None, next_poll_at, 1),
+        (TaskStatus.finished, None, None, 0),
+    ]
+
+
+def test_settle_queued_doesnt_overwrite_a_settled_item(run_db):
+    async def scenario():
+        async with TaskItemRepository() as repository:
+            task, items = await _create_task(repository, TaskStatus.queued, TaskStatus.finished)
+            settled = [
+                await repository.settle_queued(item.external_id, TaskStatus.error, result_url="http://callback")
+                for item in items
+            ]
+            return settled, await _statuses(repository, items)
+
+    settled, statuses = run_db(scenario())
+    assert settled == [True, False]
+    assert [(status, result_url) for status, result_url, *_ in statuses] == [
+        (TaskStatus.error, "http://callback"),
+        (TaskStatus.finished, None),
+    ]
@@ -0,0 +1,87 @@
+import asyncio
+import io
+import uuid
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from limits import parse
+from sqlalchemy import select
+
+from app.db.tables import IdempotencyKey, Task, TaskStatus, TaskType
+from app.repositories.spool import SpoolRepository
+from app.schemas.task import ImageSize, TaskImageCreateSchema, TaskSchema
+from app.services.notifier import task_status_hub
+from app.services.task import TaskService
+
+
+def test_wait_doesnt_hold_a_connection(run_db):
+    async def scenario():
+        from sqlalchemy_service.base_db.base import engine
+
+        async with TaskService() as service:
+            task = Task(type=TaskType.image, user_id="user", app_bundle="bundle")
+            service.task_repository.session.add(task)
+            await service.task_repository.session.commit()
+
+            waiting = asyncio.create_task(service.wait(task.id, 5))
+            await asyncio.sleep(0.1)
+            checked_out = engine.pool.checkedout()
+            task_status_hub.publish(TaskSchema(id=task.id, status=TaskStatus.finished, result_url="http://result"))
+            return checked_out, await waiting
+
+    checked_out, schema = run_db(scenario())
+    assert checked_out == 0
+    assert schema.status == TaskStatus.finished
+    assert schema.result_url == "http://result"
+
+
+def _image_schema(user_id: str) -> TaskImageCreateSchema:
+    return TaskImageCreateSchema(prompt="cat", user_id=user_id, app_bundle="bundle", aspect_ratio=ImageSize.square)
+
+
+def test_request_losing_idempotency_race_doesnt_spend_quota(run_db):
+    schema = _image_schema(f"user-{uuid.uuid4()}")
+
+    async def create():
+        async with TaskService() as service:
+            service.quota_repository.user_quota = parse("1/minute")
+            return await service.create_image(schema, idempotency_key="key")
+
+    async def scenario():
+        return await asyncio.gather(create(), create())
+
+    first, second = run_db(scenario())
+    assert first.id == second.id
+
+
+def test_too_large_upload_doesnt_spend_quota(run_db, monkeypatch):
+    monkeypatch.setattr(SpoolRepository, "max_size", 4)
+
+    async def scenario():
+        async with TaskService() as service:
+            service.quota_repository.user_quota = parse("1/minute")
+            schema = _image_schema(f"user-{uuid.uuid4()}")
+            with pytest.raises(HTTPException) as error:
+                await service.create_image_to_image(schema, UploadFile(io.BytesIO(b"too large")))
+            await service.create_image_to_image(schema, UploadFile(io.BytesIO(b"ok")))
+            return error.value.status_code
+
+    assert run_db(scenario()) == 413
+
+
+def test_rejected_by_quota_creates_nothing(run_db):
+    async def scenario():
+        async with TaskService() as service:
+            service.quota_repository.user_quota = parse("1/minute")
+            schema = _image_schema(f"user-{uuid.uuid4()}")
+            await service.create_image(schema)
+            with pytest.raises(HTTPException) as error:
+                await service.create_image(schema, idempotency_key="other")
+            tasks = await service.task_repository.session.scalars(select(Task).where(Task.user_id == schema.user_id))
+            keys = await service.task_repository.session.scalars(select(IdempotencyKey))
+            return error.value.status_code, len(tasks.all()), keys.all()
+
+    status_code, tasks, keys = run_db(scenario())
+    assert status_code == 429
+    assert tasks == 1
+    assert keys == []
@@ -0,0 +1,44 @@
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+
+from app.middlewares import UploadSizeLimitMiddleware
+
+
+def _client(parsed: list) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, max_size=1024)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile):
+        parsed.append(file.filename)
+
+    return TestClient(app)
+
+
+def test_declared_oversized_body_is_rejected_before_parsing():
+    parsed = []
+    response = _client(parsed).post("/upload", files={"file": ("a.jpg", b"x" * 4096)})
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_undeclared_oversized_body_is_cut_off():
+    parsed = []
+
+    def chunks():
+        yield b"--boundary\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.jpg\"\r\n\r\n"
+        for _ in range(8):
+            yield b"x" * 512
+
+    response = _client(parsed).post(
+        "/upload", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=boundary"}
+    )
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_small_upload_passes():
+    parsed = []
+    response = _client(parsed).post("/upload", files={"file": ("a.jpg", b"x" * 16)})
+    assert response.status_code == 200
+    assert parsed == ["a.jpg"]